@@ -0,0 +1 @@
+"""benchmark and load-test harness that drives the real cogs through fake discord objects"""
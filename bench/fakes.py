@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+
+# Stand-ins for the discord objects the cogs touch. They only implement what the command bodies use,
+# sent messages are kept on the context so a run can be checked afterwards.
+
+_ids = itertools.count(10_000)
+
+
+class FakeAsset:
+    __slots__ = ("url",)
+
+    def __init__(self, url):
+        self.url = url
+
+    def __str__(self):
+        return self.url
+
+
+class FakeUser:
+    __slots__ = ("id", "name", "display_name", "mention", "avatar", "bot")
+
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.avatar = FakeAsset(f"https://cdn.example/avatars/{user_id}.png")
+        self.bot = False
+
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeGuild:
+    __slots__ = ("id", "name")
+
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.name = f"guild{guild_id}"
+
+
+class FakeMessage:
+    __slots__ = ("id", "content", "embed", "view")
+
+    def __init__(self, content=None, embed=None, view=None):
+        self.id = next(_ids)
+        self.content = content
+        self.embed = embed
+        self.view = view
+
+
+class FakeChannel:
+    __slots__ = ("id", "guild", "sent", "send_latency")
+
+    def __init__(self, channel_id, guild=None, send_latency=0.0):
+        self.id = channel_id
+        self.guild = guild
+        self.sent = []
+        self.send_latency = send_latency
+
+    async def send(self, content=None, *, embed=None, view=None, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        message = FakeMessage(content, embed, view)
+        self.sent.append(message)
+        return message
+
+
+# commands.Context look-alike, the command bodies only use author/channel/guild/command/send.
+class FakeContext:
+    def __init__(self, bot, command, author, channel):
+        self.bot = bot
+        self.command = command
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        message = await self.channel.send(content, **kwargs)
+        self.sent.append(message)
+        return message
+
+
+class FakeResponse:
+    __slots__ = ("channel", "sent", "done")
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.sent = []
+        self.done = False
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.sent.append(await self.channel.send(content, **kwargs))
+
+    async def send_modal(self, modal):
+        self.done = True
+        self.sent.append(modal)
+
+    def is_done(self):
+        return self.done
+
+
+# discord.Interaction look-alike for modal submissions.
+class FakeInteraction:
+    def __init__(self, bot, user, channel):
+        self.client = bot
+        self.user = user
+        self.channel = channel
+        self.guild = channel.guild
+        self.response = FakeResponse(channel)
@@ -0,0 +1,342 @@
+"""replays a command mix against the real cogs and reports throughput, latency, db round trips and allocations
+
+    python -m bench.run --mix default --rate 50 --duration 10
+    python -m bench.run --mix default --save-baseline bench/baselines/default.json
+    python -m bench.run --mix default --baseline bench/baselines/default.json
+
+Without --dsn the cogs talk to the in-process postgres stand-in from bench/stubdb.py, reddit and zenquotes
+are always served by the stub server from bench/stubhttp.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+import discord
+from discord.ext import commands
+
+from bench.fakes import FakeChannel, FakeContext, FakeGuild, FakeInteraction, FakeUser
+from bench.stubdb import CountingPool, RoundTrips, StubPool, round_trips
+from bench.stubhttp import StubHTTPServer
+from utils import db, queries
+
+MIXES_PATH = os.path.join(os.path.dirname(__file__), "mixes.json")
+FORM_SUBMIT = "fitness_form.submit"
+
+# Statements whose real answer is never empty, the stand-in returns these rows for them.
+STUB_ANSWERS = {
+    queries.STATEMENTS["profiles.get"]: {
+        "powerlevel": 3, "strength": 120, "pushup": 400, "pullup": 90, "run": 25, "situp": 300,
+        "timex": 640, "active_goals": 2, "completed_goals": 5,
+    },
+    # past the level 3 threshold, so every submission also runs the level-up
+    queries.STATEMENTS["leveling.add_stats"]: {
+        "powerlevel": 3, "strength": 320, "pushup": 420, "pullup": 95, "run": 27, "situp": 330,
+    },
+    queries.STATEMENTS["timers.start"]: 1,
+    queries.STATEMENTS["timex.add"]: 700,
+}
+
+
+# `then` lists commands the same user runs in the same channel once this one finished, e.g. end_timer after
+# start_timer, each of them is measured on its own.
+class CommandSpec:
+    __slots__ = ("command", "args", "weight", "then")
+
+    def __init__(self, command, args=(), weight=1, then=()):
+        self.command = command
+        self.args = tuple(args)
+        self.weight = weight
+        self.then = tuple(CommandSpec(**entry) for entry in then)
+
+
+def load_mix(name):
+    with open(MIXES_PATH, encoding="utf-8") as file:
+        mixes = json.load(file)
+    if name not in mixes:
+        raise SystemExit(f"Unknown mix '{name}', available: {', '.join(mixes)}")
+    return [CommandSpec(**entry) for entry in mixes[name]]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.pools = []
+        self.http = StubHTTPServer(latency=args.http_latency).start()
+        self.bot = None
+        self.main = None
+
+    async def _create_pool(self):
+        if self.args.dsn:
+            import asyncpg
+            pool = await asyncpg.create_pool(self.args.dsn)
+        else:
+            pool = StubPool(latency=self.args.db_latency, max_size=self.args.pool_size, answers=STUB_ANSWERS)
+        pool = CountingPool(pool)
+        self.pools.append(pool)
+        return pool
+
+    async def __aenter__(self):
+        os.environ["REDDIT_OAUTH_URL"] = self.http.url
+        os.environ["REDDIT_URL"] = self.http.url
+        os.environ["ZENQUOTES_URL"] = f"{self.http.url}/api/random"
+        for name in ("REDDIT_CLIENT_ID", "REDDIT_CLIENT_SECRET", "REDDIT_USER_AGENT"):
+            os.environ.setdefault(name, "zenith-bench")
+        db.set_pool_factory(self._create_pool)
+
+        from cogs.fitness import Fitness
+        from cogs.goal import GoalManagement
+        from cogs.reddit import Leisure
+        from cogs.settings import GuildConfig
+        from cogs.time import TimeManagement
+
+        self.bot = commands.Bot(command_prefix=".", intents=discord.Intents.default())
+        await self.bot.__aenter__()
+        for cog in (GuildConfig, TimeManagement, GoalManagement, Fitness, Leisure):
+            await self.bot.add_cog(cog(self.bot))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        for name in list(self.bot.cogs):
+            await self.bot.remove_cog(name)
+        await self.bot.__aexit__(*exc_info)
+        for pool in self.pools:
+            await pool.close()
+        db.set_pool_factory(None)
+        self.http.stop()
+
+    def resolve(self, name):
+        if name == "quote":
+            if self.main is None:
+                import main
+                self.main = main
+            return self.main.quote
+        command = self.bot.get_command(name)
+        if command is None:
+            raise SystemExit(f"The bot has no command named '{name}'.")
+        return command
+
+    async def invoke(self, spec, user, channel):
+        if spec.command == FORM_SUBMIT:
+            from cogs.fitness import FitnessForm
+            form = FitnessForm(self.bot.get_cog("Fitness"))
+            for field, value in zip((form.pushups, form.situps, form.pullups, form.run), spec.args):
+                field._value = value
+            await form.on_submit(FakeInteraction(self.bot, user, channel))
+            return
+        command = self.resolve(spec.command)
+        # the bot's invoke hooks are skipped when calling a command directly, so trace it here instead
+        with queries.catalogue.trace(spec.command):
+            await command(FakeContext(self.bot, command, user, channel), *spec.args)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.round_trips = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.allocations = {}
+
+    async def measure(self, harness, spec, user, channel):
+        counter = RoundTrips()
+        round_trips.set(counter)  # this runs in its own task, so the counter only sees this command
+        started = time.perf_counter()
+        try:
+            await harness.invoke(spec, user, channel)
+        except Exception as error:
+            self.errors[spec.command] += 1
+            if self.errors[spec.command] == 1:
+                print(f"{spec.command} failed: {error!r}", file=sys.stderr)
+            return
+        self.latencies[spec.command].append(time.perf_counter() - started)
+        self.round_trips[spec.command].append(counter.count)
+        for follow_up in spec.then:
+            await self.measure(harness, follow_up, user, channel)
+
+
+# open loop replay, commands are started on schedule whether or not earlier ones have finished
+async def replay(harness, mix, recorder, rate, duration, users, guilds):
+    rng = random.Random(harness.args.seed)
+    weights = [spec.weight for spec in mix]
+    guild_pool = [FakeGuild(100 + index) for index in range(guilds)]
+    channels = [FakeChannel(1000 + index, guild) for index, guild in enumerate(guild_pool)]
+    user_pool = [FakeUser(1_000_000 + index) for index in range(users)]
+    # a user always talks in the same channel, so their commands land in the same guild's data
+    home_channel = {user.id: channels[index % len(channels)] for index, user in enumerate(user_pool)}
+
+    total = int(rate * duration)
+    tasks = []
+    started = time.perf_counter()
+    for index in range(total):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        spec = rng.choices(mix, weights)[0]
+        user = rng.choice(user_pool)
+        tasks.append(asyncio.create_task(recorder.measure(harness, spec, user, home_channel[user.id])))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started
+
+
+# runs every command alone under tracemalloc, so the peak belongs to that command only
+async def measure_allocations(harness, mix, recorder, samples):
+    channel = FakeChannel(999, FakeGuild(99))
+    peaks = defaultdict(list)
+
+    async def measure(spec, user):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        try:
+            await harness.invoke(spec, user, channel)
+        except Exception:
+            pass
+        peaks[spec.command].append(tracemalloc.get_traced_memory()[1] - before)
+        for follow_up in spec.then:
+            await measure(follow_up, user)
+
+    tracemalloc.start()
+    try:
+        for spec in mix:
+            for sample in range(samples):
+                await measure(spec, FakeUser(2_000_000 + sample))
+    finally:
+        tracemalloc.stop()
+    for name, samples_taken in peaks.items():
+        recorder.allocations[name] = sum(samples_taken) / len(samples_taken)
+
+
+def build_report(recorder, elapsed):
+    report = {"commands": {}, "total": {}}
+    all_latencies = []
+    completed = 0
+    for name in sorted(set(recorder.latencies) | set(recorder.errors)):
+        latencies = sorted(recorder.latencies[name])
+        trips = recorder.round_trips[name]
+        all_latencies.extend(latencies)
+        completed += len(latencies)
+        report["commands"][name] = {
+            "count": len(latencies),
+            "errors": recorder.errors[name],
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": (latencies[-1] if latencies else 0.0) * 1000,
+            "db_round_trips": sum(trips) / len(trips) if trips else 0.0,
+            "alloc_peak_kib": recorder.allocations.get(name, 0.0) / 1024,
+        }
+    all_latencies.sort()
+    report["total"] = {
+        "count": completed,
+        "errors": sum(recorder.errors.values()),
+        "throughput_per_s": completed / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(all_latencies, 0.50) * 1000,
+        "p95_ms": percentile(all_latencies, 0.95) * 1000,
+        "p99_ms": percentile(all_latencies, 0.99) * 1000,
+    }
+    return report
+
+
+def print_report(report):
+    header = f"{'command':<22}{'count':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'db rt':>7}{'alloc KiB':>11}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report["commands"].items():
+        print(f"{name:<22}{row['count']:>7}{row['errors']:>5}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}"
+              f"{row['p99_ms']:>9.2f}{row['max_ms']:>9.2f}{row['db_round_trips']:>7.2f}{row['alloc_peak_kib']:>11.1f}")
+    total = report["total"]
+    print("-" * len(header))
+    print(f"{total['count']} commands, {total['errors']} errors, {total['throughput_per_s']:.1f} cmd/s, "
+          f"p50 {total['p50_ms']:.2f} ms, p95 {total['p95_ms']:.2f} ms, p99 {total['p99_ms']:.2f} ms")
+
+    print()
+    print(f"{'statement':<28}{'calls':>7}{'total ms':>10}{'avg ms':>9}{'max ms':>9}")
+    for name, calls, total_time, average, slowest in queries.catalogue.report()[:10]:
+        print(f"{name:<28}{calls:>7}{total_time * 1000:>10.1f}{average * 1000:>9.2f}{slowest * 1000:>9.2f}")
+
+
+# Absolute drift below these is treated as noise, whatever the relative change. A p95 from a few dozen samples
+# on the stand-in moves by a scheduler tick or two between identical runs.
+NOISE_FLOOR = {"p95_ms": 2.0, "alloc_peak_kib": 1.0}
+
+
+# Round trips are deterministic so any increase counts, latency and allocations get the given tolerance.
+def compare(report, baseline, tolerance):
+    regressions = []
+    for name, row in report["commands"].items():
+        before = baseline["commands"].get(name)
+        if before is None:
+            continue
+        if row["db_round_trips"] > before["db_round_trips"] + 1e-9:
+            regressions.append(f"{name}: db round trips {before['db_round_trips']:.2f} -> {row['db_round_trips']:.2f}")
+        for key in ("p95_ms", "alloc_peak_kib"):
+            if row[key] > before[key] * (1 + tolerance) and row[key] - before[key] > NOISE_FLOOR[key]:
+                regressions.append(f"{name}: {key} {before[key]:.2f} -> {row[key]:.2f}")
+    before_throughput = baseline["total"]["throughput_per_s"]
+    if before_throughput and report["total"]["throughput_per_s"] < before_throughput * (1 - tolerance):
+        regressions.append(f"throughput {before_throughput:.1f} -> {report['total']['throughput_per_s']:.1f} cmd/s")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.splitlines()[0])
+    parser.add_argument("--mix", default="default", help="command mix from bench/mixes.json")
+    parser.add_argument("--rate", type=float, default=50.0, help="commands started per second")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to replay the mix for")
+    parser.add_argument("--users", type=int, default=200, help="distinct fake users")
+    parser.add_argument("--guilds", type=int, default=5, help="distinct fake guilds")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the command and user choice")
+    parser.add_argument("--dsn", help="postgres dsn, uses the in-process stand-in when left out")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="seconds per stand-in round trip")
+    parser.add_argument("--pool-size", type=int, default=10, help="connections per stand-in pool")
+    parser.add_argument("--http-latency", type=float, default=0.02, help="seconds per stub http response")
+    parser.add_argument("--alloc-samples", type=int, default=0, help="serial runs per command measured under tracemalloc")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write the report as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline, exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative latency/alloc/throughput drift")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    mix = load_mix(args.mix)
+    recorder = Recorder()
+    async with Harness(args) as harness:
+        elapsed = await replay(harness, mix, recorder, args.rate, args.duration, args.users, args.guilds)
+        if args.alloc_samples:
+            await measure_allocations(harness, mix, recorder, args.alloc_samples)
+    report = build_report(recorder, elapsed)
+    report["settings"] = {key: value for key, value in vars(args).items() if key not in ("save_baseline", "baseline", "dsn")}
+    report["settings"]["database"] = "postgres" if args.dsn else "stand-in"
+    print_report(report)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+            file.write("\n")
+        print(f"baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print("regressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("no regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))
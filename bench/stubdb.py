@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+
+# The counter of the command currently running, every task the runner spawns sets its own.
+round_trips = contextvars.ContextVar("round_trips", default=None)
+
+
+class RoundTrips:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+def _count():
+    counter = round_trips.get()
+    if counter is not None:
+        counter.count += 1
+
+
+# Wraps a real asyncpg connection (or a stub one) and counts every call that goes to the server.
+class CountingConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def execute(self, query, *args, **kwargs):
+        _count()
+        return await self._conn.execute(query, *args, **kwargs)
+
+    async def executemany(self, query, args, **kwargs):
+        _count()
+        return await self._conn.executemany(query, args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        _count()
+        return await self._conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        _count()
+        return await self._conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        _count()
+        return await self._conn.fetchval(query, *args, **kwargs)
+
+    # BEGIN and COMMIT/ROLLBACK are a round trip each
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        _count()
+        try:
+            async with self._conn.transaction(**kwargs):
+                yield
+        finally:
+            _count()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class CountingPool:
+    def __init__(self, pool):
+        self._pool = pool
+        self.acquires = 0
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquires += 1
+        async with self._pool.acquire() as conn:
+            yield CountingConnection(conn)
+
+    async def close(self):
+        await self._pool.close()
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+
+# In-process stand-in for postgres. It does not run any SQL, every call just costs `latency` seconds and
+# returns an empty answer (or the canned one given for that statement text), so a run measures round trips
+# and pool contention rather than query plans.
+class StubConnection:
+    def __init__(self, latency, answers):
+        self.latency = latency
+        self.answers = answers
+
+    async def _round_trip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        else:
+            await asyncio.sleep(0)
+
+    async def execute(self, query, *args, **kwargs):
+        await self._round_trip()
+        verb = query.split(None, 1)[0].upper()
+        return "INSERT 0 1" if verb == "INSERT" else f"{verb} 1"
+
+    async def executemany(self, query, args, **kwargs):
+        await self._round_trip()
+
+    async def fetch(self, query, *args, **kwargs):
+        await self._round_trip()
+        return self.answers.get(query, [])
+
+    async def fetchrow(self, query, *args, **kwargs):
+        await self._round_trip()
+        return self.answers.get(query)
+
+    async def fetchval(self, query, *args, **kwargs):
+        await self._round_trip()
+        return self.answers.get(query)
+
+    @asynccontextmanager
+    async def transaction(self, **kwargs):
+        await self._round_trip()
+        yield
+        await self._round_trip()
+
+
+class StubPool:
+    def __init__(self, latency=0.0, max_size=10, answers=None):
+        self._slots = asyncio.Semaphore(max_size)  # same default size as asyncpg.create_pool
+        self._latency = latency
+        self._answers = answers or {}
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._slots:
+            yield StubConnection(self._latency, self._answers)
+
+    async def close(self):
+        pass
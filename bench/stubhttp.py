@@ -0,0 +1,77 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+LISTING_PATH = re.compile(r"^/r/([^/]+)/(\w+)")
+
+
+def _listing(subreddit, size):
+    children = []
+    for index in range(size):
+        # every fifth post has a deleted author, every seventh is nsfw and every third is not an image
+        children.append({"kind": "t3", "data": {
+            "id": f"{subreddit[:3]}{index}",
+            "name": f"t3_{subreddit[:3]}{index}",
+            "title": f"post {index}",
+            "subreddit": subreddit,
+            "author": "[deleted]" if index % 5 == 4 else f"poster{index}",
+            "over_18": index % 7 == 6,
+            "url": f"https://i.example/{subreddit}/{index}" + (".html" if index % 3 == 2 else ".png"),
+        }})
+    return {"kind": "Listing", "data": {"after": None, "before": None, "children": children}}
+
+
+def _handler(latency, listing_size):
+    class StubHandler(BaseHTTPRequestHandler):
+        def _reply(self, payload):
+            if latency:
+                time.sleep(latency)
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._reply({"access_token": "bench", "token_type": "bearer", "expires_in": 86400, "scope": "*"})
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path.startswith("/api/random"):
+                self._reply([{"q": "Benchmarks don't lie, but they do exaggerate.", "a": "Zenith"}])
+                return
+            match = LISTING_PATH.match(path)
+            if match is None:
+                self.send_error(404)
+                return
+            self._reply(_listing(match.group(1), listing_size))
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+# Serves fake reddit (oauth token + listings) and zenquotes responses from a background thread.
+class StubHTTPServer:
+    def __init__(self, latency=0.0, listing_size=30):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _handler(latency, listing_size))
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,97 @@
+import traceback
+
+import discord
+from discord.ext import commands
+
+from utils import db, queries
+from utils.lifecycle import handover
+from utils.profiles import profiles
+
+
+# Owner-only commands for looking at how the bot is doing.
+class Admin(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.command(name="db_stats")
+    async def db_stats(self, ctx, limit: int = 10):
+        """shows the most expensive database statements since startup"""
+        rows = queries.catalogue.report()
+        if not rows:
+            await ctx.send("No statements have run yet.")
+            return
+
+        embed = discord.Embed(title="Database statements", color=discord.Color.blurple())
+        for name, calls, total, average, slowest in rows[:limit]:
+            embed.add_field(
+                name=name,
+                value=f"{calls} calls, {total * 1000:.0f} ms total, {average * 1000:.1f} ms avg, {slowest * 1000:.1f} ms max",
+                inline=False
+            )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="cache_stats")
+    async def cache_stats(self, ctx):
+        """shows how well the profile cache and read coalescing are doing"""
+        stats = profiles.stats()
+        embed = discord.Embed(title="Caches", color=discord.Color.blurple())
+        embed.add_field(
+            name="Profiles",
+            value=(f"{stats['size']}/{stats['max_size']} cached\n"
+                   f"{stats['hits']} hits, {stats['misses']} misses ({stats['hit_ratio']:.0%} hit ratio)"),
+            inline=False
+        )
+        embed.add_field(
+            name="Coalesced reads",
+            value=f"{db.coalescer.shared} shared, {db.coalescer.started} sent to the database",
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="reload")
+    async def reload(self, ctx, cog: str):
+        """reloads a cog from disk, running timers, caches and connections carry over to the new version"""
+        extension = f"cogs.{cog.lower()}"
+        if extension not in self.bot.extensions:
+            await ctx.send(f"There is no loaded cog called '{cog}'.")
+            return
+
+        loaded_cogs = [loaded for loaded in self.bot.cogs.values() if type(loaded).__module__ == extension]
+
+        # config the new version reads on load is checked first, so a broken file leaves the running version alone
+        try:
+            for loaded in loaded_cogs:
+                if hasattr(loaded, "prepare_reload"):
+                    loaded.prepare_reload()
+        except Exception as error:
+            await ctx.send(f"Not reloading '{cog}', the new version would fail to load: {error}")
+            return
+
+        exporting = [loaded for loaded in loaded_cogs if hasattr(loaded, "export_state")]
+        for loaded in exporting:
+            handover.stash(loaded.qualified_name, loaded.export_state())
+
+        try:
+            await self.bot.reload_extension(extension)
+        except Exception as error:
+            print(f"Reloading {extension} failed:")
+            traceback.print_exception(type(error), error, error.__traceback__)
+            # discord.py tries to put the old version back, which takes the stashed state over again. Whatever
+            # nobody took over still belongs to the old instance, which closes it now.
+            for loaded in exporting:
+                state = handover.claim(loaded.qualified_name)
+                loaded.handed_over = False
+                if state is not None:
+                    await loaded.cog_unload()
+            if extension in self.bot.extensions:
+                await ctx.send(f"Reloading '{cog}' failed, the previous version is still running: {error}")
+            else:
+                await ctx.send(f"Reloading '{cog}' failed and it could not be restored, it is unloaded now: {error}")
+            return
+        await ctx.send(f"Reloaded '{cog}'.")
+
+async def setup(bot):
+    await bot.add_cog(Admin(bot))
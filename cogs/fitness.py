@@ -1,109 +1,86 @@
 import discord
 from discord.ext import commands
-import asyncpg
 from dotenv import load_dotenv
 import os
 
+from utils import db, queries
+from utils.announce import announcements
+from utils.guilds import FeatureDisabled, guild_id_of, settings
+from utils.lifecycle import PooledCog, ShuttingDown, lifecycle
+from utils.presence import live
+from utils.profiles import FITNESS_FIELDS, profiles
+
 load_dotenv()
 
+# Where level-ups go in guilds that haven't picked an announcement channel, read once at startup.
+FALLBACK_CHANNEL_ID = int(os.getenv('CHANNEL') or 0)
+
+# Applies every level the user has enough strength for, each level costs 100 strength per current level.
+def apply_level_ups(strength, powerlevel):
+    while strength >= 100 * powerlevel:
+        strength -= 100 * powerlevel
+        powerlevel += 1
+    return strength, powerlevel
+
 # Fitness Cog
-class Fitness(commands.Cog):
+class Fitness(PooledCog):
+    feature = "fitness"
+
     def __init__(self, bot):
         self.bot = bot
-        self.bot.loop.create_task(self.setup_database())
 
-    #sets up the database with the required access credentials 
+    #sets up the database tables, the pool to the Neon PostgreSQL database is opened by PooledCog
     async def setup_database(self):
-        db_user = os.getenv('DB_USER')
-        db_password = os.getenv('DB_PASSWORD')
-        db_name = os.getenv('DB_NAME')
-        db_host = os.getenv('DB_HOST')
-        db_port = os.getenv('DB_PORT')
-        
-        # Connect to Neon PostgreSQL database
-        self.pool = await asyncpg.create_pool(
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            host=db_host,
-            port=db_port
-        )
-
         # Create the leveling table if it doesn't exist
         async with self.pool.acquire() as conn:
             await conn.execute('''
             CREATE TABLE IF NOT EXISTS leveling (
-                user_id BIGINT PRIMARY KEY,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                user_id BIGINT,
                 powerlevel INTEGER NOT NULL,
                 strength INTEGER NOT NULL,
                 pushup INTEGER DEFAULT 0,
                 pullup INTEGER DEFAULT 0,
                 run INTEGER DEFAULT 0,
-                situp INTEGER DEFAULT 0
+                situp INTEGER DEFAULT 0,
+                PRIMARY KEY (guild_id, user_id)
             )
             ''')
-
-    # a function that allows the program to add xp to the user's profile on completion of certain activities
-    async def add_xp(self, user_id, xp_to_add):
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow(
-                "SELECT strength, powerlevel FROM leveling WHERE user_id = $1",
-                user_id
-            )
-
-            if result is None:
-                strength, powerlevel = xp_to_add, 1
-                await conn.execute(
-                    "INSERT INTO leveling (user_id, strength, powerlevel) VALUES ($1, $2, $3)",
-                    user_id, strength, powerlevel
-                )
-            else:
-                strength, powerlevel = result['strength'], result['powerlevel']
-                strength += xp_to_add
-                level_up_threshold = 100 * powerlevel
-
-                if strength >= level_up_threshold:
-                    powerlevel += 1
-                    strength -= level_up_threshold
-                    channel_id = os.getenv('CHANNEL')
-                    channel = self.bot.get_channel(channel_id)
-                    if channel:
-                        await channel.send(f"<@{user_id}> leveled up to level {powerlevel}!")
-
-                await conn.execute(
-                    "UPDATE leveling SET strength = $1, powerlevel = $2 WHERE user_id = $3",
-                    strength, powerlevel, user_id
-                )
+            await db.partition_by_guild(conn, "leveling", ("guild_id", "user_id"))
+
+    # queues the level-up message for the guild's announcement channel, the queue batches bursts of them
+    def announce_level_up(self, guild_id, user_id, powerlevel):
+        channel_id = settings.get(guild_id).announce_channel_id
+        channel = self.bot.get_channel(channel_id) if channel_id else None
+        if channel is None and FALLBACK_CHANNEL_ID:
+            channel = self.bot.get_channel(FALLBACK_CHANNEL_ID)
+            # the fallback channel lives in one guild, level-ups from other guilds don't belong there
+            if channel is not None and guild_id_of(channel) != guild_id:
+                channel = None
+        if channel is not None:
+            announcements.put(channel, f"<@{user_id}> leveled up to level {powerlevel}!")
 
     #updates the user stats, like the count of exercise and stores it in the database
-    async def update_user_stats(self, user_id, xp_to_add, pushup_add=0, pullup_add=0, run_add=0, situp_add=0):
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow(
-                "SELECT pushup, pullup, run, situp, strength, powerlevel FROM leveling WHERE user_id = $1",
-                user_id
-            )
-
-            if result is None:
-                await conn.execute(
-                    "INSERT INTO leveling (user_id, pushup, pullup, run, situp, strength, powerlevel) VALUES ($1, $2, $3, $4, $5, $6, $7)",
-                    user_id, pushup_add, pullup_add, run_add, situp_add, xp_to_add, 1
-                )
-            else:
-                pushup, pullup, run, situp, strength, powerlevel = (
-                    result['pushup'], result['pullup'], result['run'], 
-                    result['situp'], result['strength'], result['powerlevel']
-                )
-
-                pushup += pushup_add
-                pullup += pullup_add
-                run += run_add
-                situp += situp_add
-                strength += xp_to_add
-
-                await conn.execute(
-                    "UPDATE leveling SET pushup = $1, pullup = $2, run = $3, situp = $4, strength = $5, powerlevel = $6 WHERE user_id = $7",
-                    pushup, pullup, run, situp, strength, powerlevel, user_id
-                )
+    async def update_user_stats(self, guild_id, user_id, xp_to_add, pushup_add=0, pullup_add=0, run_add=0, situp_add=0):
+        # the upsert adds to the counts, so concurrent submissions add up instead of overwriting each other, and it
+        # keeps the row locked until the level-up is written in the same transaction
+        version = profiles.begin_write(guild_id, user_id)
+        async with db.unit_of_work(self.pool) as conn:
+            result = await queries.fetchrow(conn, "leveling.add_stats", guild_id, user_id, pushup_add, pullup_add, run_add, situp_add, xp_to_add)
+            fields = {field: result[field] for field in FITNESS_FIELDS}
+
+            strength, powerlevel = apply_level_ups(result['strength'], result['powerlevel'])
+            if powerlevel != result['powerlevel']:
+                await queries.execute(conn, "leveling.set_level", strength, powerlevel, guild_id, user_id)
+                fields.update(strength=strength, powerlevel=powerlevel)
+        live.workout_logged()
+        db.forget((guild_id, user_id))
+        profiles.update(guild_id, user_id, version, **fields)
+
+        # announced once the new level is committed
+        if powerlevel != result['powerlevel']:
+            self.announce_level_up(guild_id, user_id, powerlevel)
+        return fields
 
     #displays the overall fitness stats of the user, remember that the database is stored in neon tech postgreSQL
     @commands.command(name="fitness_stats")
@@ -111,13 +88,9 @@ class Fitness(commands.Cog):
         """displays the users fitness stats"""
         member = member or ctx.author
 
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow(
-                "SELECT * FROM leveling WHERE user_id = $1",
-                member.id
-            )
+        result = await profiles.get(self.pool, guild_id_of(ctx), member.id)
 
-        if result is None:
+        if not result.has_fitness:
             if member == ctx.author:
                 await ctx.send("You don't have any fitness data yet. Use the fitness form to log your activities!")
             else:
@@ -129,22 +102,50 @@ class Fitness(commands.Cog):
             color=discord.Color.green()
         )
         embed.set_thumbnail(url=member.avatar.url)
-        embed.add_field(name="Power Level", value=result['powerlevel'], inline=False)
-        embed.add_field(name="Strength", value=result['strength'], inline=False)
-        embed.add_field(name="Push-ups", value=result['pushup'], inline=True)
-        embed.add_field(name="Pull-ups", value=result['pullup'], inline=True)
-        embed.add_field(name="Running (Km)", value=result['run'], inline=True)
-        embed.add_field(name="Sit-ups", value=result['situp'], inline=True)
+        embed.add_field(name="Power Level", value=result.powerlevel, inline=False)
+        embed.add_field(name="Strength", value=result.strength, inline=False)
+        embed.add_field(name="Push-ups", value=result.pushup, inline=True)
+        embed.add_field(name="Pull-ups", value=result.pullup, inline=True)
+        embed.add_field(name="Running (Km)", value=result.run, inline=True)
+        embed.add_field(name="Sit-ups", value=result.situp, inline=True)
         embed.set_footer(text="Keep up the great work!")
 
         await ctx.send(embed=embed)
 
+    #displays everything the bot tracks for the user in one place, served from the profile cache when it is warm
+    @commands.command(name="profile")
+    async def profile(self, ctx, member: discord.Member = None):
+        """displays the users power level, Timex and goals"""
+        member = member or ctx.author
+        profile = await profiles.get(self.pool, guild_id_of(ctx), member.id)
+
+        embed = discord.Embed(
+            title=f"{member.display_name}'s Profile",
+            color=discord.Color.gold()
+        )
+        embed.set_thumbnail(url=member.avatar.url)
+        embed.add_field(name="Power Level", value=profile.powerlevel if profile.has_fitness else "-", inline=True)
+        embed.add_field(name="Strength", value=profile.strength if profile.has_fitness else "-", inline=True)
+        embed.add_field(name="Timex", value=profile.timex or 0, inline=True)
+        embed.add_field(name="Active Goals", value=profile.active_goals, inline=True)
+        embed.add_field(name="Completed Goals", value=profile.completed_goals, inline=True)
+
+        await ctx.send(embed=embed)
+
     @commands.command(name="fitness_form")
     async def fitness_form(self, ctx):
         """generates a form that allows you to enter your exercise cycle for the day"""
         view = FitnessFormButton(self)
         await ctx.send("Click the button below to fill out the fitness form:", view=view)
 
+# Form interactions don't go through the bot's command checks, so they check the guild's fitness toggle here.
+# Returns False after telling the user when it is turned off.
+async def refuse_if_disabled(interaction):
+    if settings.is_enabled(guild_id_of(interaction), Fitness.feature):
+        return True
+    await interaction.response.send_message(str(FeatureDisabled(Fitness.feature)), ephemeral=True)
+    return False
+
 # Fitness Form Modal
 class FitnessForm(discord.ui.Modal):
     def __init__(self, cog):
@@ -180,6 +181,19 @@ class FitnessForm(discord.ui.Modal):
         self.add_item(self.run)
 
     async def on_submit(self, interaction: discord.Interaction):
+        # refused like a command once shutdown started, the pools may already be closing
+        if lifecycle.closing:
+            await interaction.response.send_message(str(ShuttingDown()), ephemeral=True)
+            return
+        # buttons posted before the guild turned fitness off still open the form
+        if not await refuse_if_disabled(interaction):
+            return
+        # counted like a command, so shutdown waits for the submission to be written
+        async with lifecycle.track():
+            with queries.catalogue.trace("fitness_form"):
+                await self.submit(interaction)
+
+    async def submit(self, interaction: discord.Interaction):
         try:
             pushups = int(self.pushups.value)
             situps = int(self.situps.value)
@@ -193,6 +207,7 @@ class FitnessForm(discord.ui.Modal):
             total_points = pushup_points + situp_points + pullup_points + run_points
 
             await self.cog.update_user_stats(
+                guild_id=guild_id_of(interaction),
                 user_id=interaction.user.id,
                 xp_to_add=total_points,
                 pushup_add=pushups,
@@ -222,6 +237,8 @@ class FitnessFormButton(discord.ui.View):
         self.add_item(button)
 
     async def open_form(self, interaction: discord.Interaction):
+        if not await refuse_if_disabled(interaction):
+            return
         await interaction.response.send_modal(FitnessForm(self.cog))
 
 # Add the cog to the bot
@@ -1,24 +1,28 @@
 import discord
 from discord.ext import commands
-import asyncpg
 from datetime import datetime
 from dotenv import load_dotenv
-import os
+
+from utils import db, queries
+from utils.guilds import guild_id_of
+from utils.lifecycle import PooledCog
+from utils.profiles import profiles
 
 load_dotenv()
 
-class GoalManagement(commands.Cog):
-    def __init__(self, bot, db_pool):
+class GoalManagement(PooledCog):
+    feature = "goals"
+
+    def __init__(self, bot):
         self.bot = bot
-        self.db_pool = db_pool
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+    async def setup_database(self):
         # Ensure the table exists and has the 'completed' column
-        async with self.db_pool.acquire() as conn:
+        async with self.pool.acquire() as conn:
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS goals (
                     id SERIAL PRIMARY KEY,
+                    guild_id BIGINT NOT NULL DEFAULT 0,
                     user_id BIGINT NOT NULL,
                     name TEXT NOT NULL,
                     deadline DATE NOT NULL,
@@ -27,19 +31,19 @@ class GoalManagement(commands.Cog):
                     completed BOOLEAN DEFAULT FALSE
                 )
             ''')
+            await db.partition_by_guild(conn, "goals")
 
     @commands.command(name='set_goal')
     async def set_goal(self, ctx, goal_name: str, deadline: str, priority: str):
         """allows you to set a goal"""
         try:
             deadline_date = datetime.strptime(deadline, "%d-%m-%Y").date()
-            user_id = ctx.author.id
+            guild_id, user_id = guild_id_of(ctx), ctx.author.id
 
-            async with self.db_pool.acquire() as conn:
-                await conn.execute('''
-                    INSERT INTO goals (user_id, name, deadline, priority, progress, completed)
-                    VALUES ($1, $2, $3, $4, $5, $6)
-                ''', user_id, goal_name, deadline_date, priority, 0, False)
+            async with self.pool.acquire() as conn:
+                await queries.execute(conn, "goals.insert", guild_id, user_id, goal_name, deadline_date, priority, 0, False)
+            db.forget((guild_id, user_id))
+            profiles.invalidate(guild_id, user_id)  # goal counts changed
 
             await ctx.send(f"Goal '{goal_name}' added successfully with deadline {deadline} and priority {priority}.")
         except Exception as e:
@@ -49,15 +53,9 @@ class GoalManagement(commands.Cog):
     @commands.command(name='view_goals')
     async def view_goals(self, ctx):
         """displays the list of all the goals and its progress"""
-        user_id = ctx.author.id
+        guild_id, user_id = guild_id_of(ctx), ctx.author.id
 
-        async with self.db_pool.acquire() as conn:
-            goals = await conn.fetch('''
-                SELECT name, deadline, priority, progress
-                FROM goals
-                WHERE user_id = $1 AND completed = FALSE
-                ORDER BY priority, deadline
-            ''', user_id)
+        goals = await db.fetch_shared(self.pool, (guild_id, user_id), "goals.active", guild_id, user_id)
 
         if not goals:
             await ctx.send("You have no active goals.")
@@ -84,42 +82,46 @@ class GoalManagement(commands.Cog):
     @commands.command(name='update_goal')
     async def update_goal(self, ctx, goal_name: str, field: str, value):
         """updates the specified parameter of the goal"""
-        user_id = ctx.author.id
+        guild_id, user_id = guild_id_of(ctx), ctx.author.id
+
+        # Each field is a single UPDATE, a goal that doesn't exist simply updates no rows
+        if field == 'progress':
+            value = int(value)
+            statement = "goals.set_progress"
+            # If the progress reaches 100%, the goal is marked as completed by the same statement
+            message = (f"Goal '{goal_name}' has been marked as completed." if value == 100
+                       else f"Progress for goal '{goal_name}' updated to {value}%.")
+        elif field == 'deadline':
+            new_deadline = value
+            value = datetime.strptime(value, "%d-%m-%Y").date()
+            statement = "goals.set_deadline"
+            message = f"Deadline for goal '{goal_name}' updated to {new_deadline}."
+        elif field == 'priority':
+            statement = "goals.set_priority"
+            message = f"Priority for goal '{goal_name}' updated to {value}."
+        else:
+            await ctx.send("Invalid field. You can update 'progress', 'deadline', or 'priority'.")
+            return
 
-        async with self.db_pool.acquire() as conn:
-            goal = await conn.fetchrow('''SELECT * FROM goals WHERE user_id = $1 AND name = $2''', user_id, goal_name)
+        async with self.pool.acquire() as conn:
+            result = await queries.execute(conn, statement, value, guild_id, user_id, goal_name)
+        db.forget((guild_id, user_id))
+        profiles.invalidate(guild_id, user_id)
 
-            if not goal:
-                await ctx.send(f"Goal '{goal_name}' not found.")
-                return
-
-            if field == 'progress':
-                progress = int(value)
-                await conn.execute('''UPDATE goals SET progress = $1 WHERE user_id = $2 AND name = $3''', progress, user_id, goal_name)
-
-                # If the progress reaches 100%, mark the goal as completed
-                if progress == 100:
-                    await conn.execute('''UPDATE goals SET completed = TRUE WHERE user_id = $1 AND name = $2''', user_id, goal_name)
-                    await ctx.send(f"Goal '{goal_name}' has been marked as completed.")
-                else:
-                    await ctx.send(f"Progress for goal '{goal_name}' updated to {progress}%.")
-            elif field == 'deadline':
-                new_deadline = datetime.strptime(value, "%d-%m-%Y").date()
-                await conn.execute('''UPDATE goals SET deadline = $1 WHERE user_id = $2 AND name = $3''', new_deadline, user_id, goal_name)
-                await ctx.send(f"Deadline for goal '{goal_name}' updated to {value}.")
-            elif field == 'priority':
-                await conn.execute('''UPDATE goals SET priority = $1 WHERE user_id = $2 AND name = $3''', value, user_id, goal_name)
-                await ctx.send(f"Priority for goal '{goal_name}' updated to {value}.")
-            else:
-                await ctx.send("Invalid field. You can update 'progress', 'deadline', or 'priority'.")
+        if result == "UPDATE 0":
+            await ctx.send(f"Goal '{goal_name}' not found.")
+        else:
+            await ctx.send(message)
 
     @commands.command(name='delete_goal')
     async def delete_goal(self, ctx, goal_name: str):
         """deletes the specified goal"""
-        user_id = ctx.author.id
+        guild_id, user_id = guild_id_of(ctx), ctx.author.id
 
-        async with self.db_pool.acquire() as conn:
-            result = await conn.execute('''DELETE FROM goals WHERE user_id = $1 AND name = $2''', user_id, goal_name)
+        async with self.pool.acquire() as conn:
+            result = await queries.execute(conn, "goals.delete", guild_id, user_id, goal_name)
+            db.forget((guild_id, user_id))
+            profiles.invalidate(guild_id, user_id)
 
             if result == "DELETE 0":
                 await ctx.send(f"Goal '{goal_name}' not found.")
@@ -129,15 +131,9 @@ class GoalManagement(commands.Cog):
     @commands.command(name='view_completed_goals')
     async def view_completed_goals(self, ctx):
         """returns the list of completed user goals"""
-        user_id = ctx.author.id
+        guild_id, user_id = guild_id_of(ctx), ctx.author.id
 
-        async with self.db_pool.acquire() as conn:
-            completed_goals = await conn.fetch('''
-                SELECT name, deadline, priority, progress
-                FROM goals
-                WHERE user_id = $1 AND completed = TRUE
-                ORDER BY deadline
-            ''', user_id)
+        completed_goals = await db.fetch_shared(self.pool, (guild_id, user_id), "goals.completed", guild_id, user_id)
 
         if not completed_goals:
             await ctx.send("You have no completed goals.")
@@ -156,17 +152,4 @@ class GoalManagement(commands.Cog):
 
 # Add this cog to the bot
 async def setup(bot):
-    db_user = os.getenv('DB_USER')
-    db_password = os.getenv('DB_PASSWORD')
-    db_name = os.getenv('DB_NAME')
-    db_host = os.getenv('DB_HOST')
-    db_port = os.getenv('DB_PORT')
-    
-    db_pool = await asyncpg.create_pool(
-        user=db_user,
-        password=db_password,
-        database=db_name,
-        host=db_host,
-        port=db_port
-    )
-    await bot.add_cog(GoalManagement(bot, db_pool))
+    await bot.add_cog(GoalManagement(bot))
@@ -2,22 +2,64 @@ import discord
 from discord.ext import commands
 from random import choice
 import asyncpraw as praw
+import asyncio
 from dotenv import load_dotenv
 import os
 
+from utils.feeds import load_feeds
+from utils.lifecycle import handover, lifecycle
+from utils.lru import LRUSet
+
 load_dotenv()
 
 
 #Create a class reddit, we can get the client id, secret and user agent from the "https://www.reddit.com/prefs/apps", this website after creating an app.
 class Leisure(commands.Cog):
+    feature = "leisure"
+
     def __init__(self, bot):
         self.bot = bot
+        self.reddit = None
+        self.handed_over = False
+
+        # Every feed in feeds.json becomes a command of this cog, they all share send_feed as their callback.
+        recent_posts, self.feeds = load_feeds(os.getenv("FEEDS_CONFIG", "feeds.json"))
+        self.recent_posts = LRUSet(recent_posts)  # (channel_id, post_id) pairs that were shown recently
+        self.__cog_commands__ += tuple(
+            commands.Command(Leisure.send_feed, name=feed.name, help=feed.help)
+            for feed in self.feeds.values()
+        )
+
+    async def cog_load(self):
+        # after a reload the previous instance hands over its reddit session and the posts it has shown,
+        # the feeds are read again so changes to feeds.json are picked up
+        state = handover.claim(self.qualified_name)
+        if state is not None:
+            self.reddit = state["reddit"]
+            self.recent_posts = state["recent_posts"]
+            return
         self.reddit = praw.Reddit(
             client_id=os.getenv("REDDIT_CLIENT_ID"),
             client_secret=os.getenv("REDDIT_CLIENT_SECRET"),
-            user_agent=os.getenv("REDDIT_USER_AGENT")
+            user_agent=os.getenv("REDDIT_USER_AGENT"),
+            # only set when pointing the bot at a stand-in reddit server, e.g. the benchmark one
+            **{setting: os.getenv(env) for setting, env in (("oauth_url", "REDDIT_OAUTH_URL"), ("reddit_url", "REDDIT_URL")) if os.getenv(env)}
         )
 
+    # called by .reload before anything is handed over, the new version reads feeds.json again and a broken
+    # entry or a feed named like another command would stop it from loading
+    def prepare_reload(self):
+        _, feeds = load_feeds(os.getenv("FEEDS_CONFIG", "feeds.json"))
+        for name in feeds:
+            command = self.bot.get_command(name)
+            if command is not None and command.cog is not self:
+                raise ValueError(f"Feed '{name}' clashes with the existing '{command.qualified_name}' command.")
+
+    # called by .reload before the extension is reloaded, the session stays open for the next instance
+    def export_state(self):
+        self.handed_over = True
+        return {"reddit": self.reddit, "recent_posts": self.recent_posts}
+
 
 #This is to check if the thing is actually working or not.
     @commands.Cog.listener()
@@ -25,120 +67,38 @@ class Leisure(commands.Cog):
         print(f"{__name__} is ready!")
 
 
-#This creates a command that filters out reddit posts with the tag memes, it will then fetch 30 posts from the reddit API, filter the content using if loops and append the nested lists into the "posts_lists". In the end, we use the random function to output a random meme from the list.
-    @commands.command()
-    async def meme(self, ctx: commands.Context):
-        """generates a random meme from the reddit."""
-        subreddit = await self.reddit.subreddit("memes")
-        posts_lists = []
-
-        async for post in subreddit.hot(limit=30):
-            if not post.over_18 and post.author is not None and any(post.url.endswith(ext) for ext in [".png",".jpg",".jpeg",".gif"]):
-                author_name = post.author.name
-                posts_lists.append((post.url, author_name))
-            if post.author is None:
-                posts_lists.append((posts_lists, "N/A"))
-
-        if posts_lists:
-
-            random_post = choice(posts_lists)
-
-            meme_embed = discord.Embed(title="Random Meme", description="Fetches random meme for r/memes", color= discord.Color.random())
-            meme_embed.set_author(name=f"Meme requested by {ctx.author.name}", icon_url=ctx.author.avatar)
-            meme_embed.set_image(url=random_post[0])
-            meme_embed.set_footer(text=f"Post created by {random_post[1]}.", icon_url=None)
-            await ctx.send(embed = meme_embed)
-
-        else:
-            await ctx.send("Unable to fetch post, try again later.")
-
-
-    #This command is for Jujutsu kaisen posts
-    @commands.command()
-    async def jjk(self, ctx: commands.Context):
-        """generate a random jujutsu kaisen meme from the reddit."""
-        subreddit = await self.reddit.subreddit("memes")
-        posts_lists = []
-
-        async for post in subreddit.search("Jujutsu Kaisen", limit=30):
-            if not post.over_18 and post.author is not None and any(post.url.endswith(ext) for ext in [".png",".jpg",".jpeg",".gif"]):
-                author_name = post.author.name
-                posts_lists.append((post.url, author_name))
-            if post.author is None:
-                posts_lists.append((posts_lists, "N/A"))
-
-        if posts_lists:
-
-            random_post = choice(posts_lists)
-
-            meme_embed = discord.Embed(title="Random Meme", description="Fetches random meme for r/jjk", color= discord.Color.random())
-            meme_embed.set_author(name=f"Meme requested by {ctx.author.name}", icon_url=ctx.author.avatar)
-            meme_embed.set_image(url=random_post[0])
-            meme_embed.set_footer(text=f"Post created by {random_post[1]}.", icon_url=None)
-            await ctx.send(embed = meme_embed)
-
-        else:
-            await ctx.send("Unable to fetch post, try again later.")
-
-
-    #This command is for one piece posts
-    @commands.command()
-    async def one(self, ctx: commands.Context):
-        """generate a random one-piece meme from the reddit."""
-        subreddit = await self.reddit.subreddit("memes")
+#This is the shared body of every feed command. It fetches the posts for the feed the command was invoked as, keeps the ones that pass the feed's filters in a single pass and then sends a random one, skipping posts this channel has already seen while there are fresh ones left.
+    async def send_feed(self, ctx: commands.Context):
+        feed = self.feeds[ctx.command.name]
+        subreddit = await self.reddit.subreddit(feed.subreddit)
         posts_lists = []
 
-        async for post in subreddit.search("One Piece", limit=30):
-            if not post.over_18 and post.author is not None and any(post.url.endswith(ext) for ext in [".png",".jpg",".jpeg",".gif"]):
-                author_name = post.author.name
-                posts_lists.append((post.url, author_name))
-            if post.author is None:
-                posts_lists.append((posts_lists, "N/A"))
-
-        if posts_lists:
-
-            random_post = choice(posts_lists)
+        async for post in feed.listing(subreddit):
+            if feed.matches(post):
+                posts_lists.append((post.url, post.author.name, post.id))
 
-            meme_embed = discord.Embed(title="Random Meme", description="Fetches random meme for r/onepiece", color= discord.Color.random())
-            meme_embed.set_author(name=f"Meme requested by {ctx.author.name}", icon_url=ctx.author.avatar)
-            meme_embed.set_image(url=random_post[0])
-            meme_embed.set_footer(text=f"Post created by {random_post[1]}.", icon_url=None)
-            await ctx.send(embed = meme_embed)
-
-        else:
+        if not posts_lists:
             await ctx.send("Unable to fetch post, try again later.")
+            return
 
+        fresh_posts = [post for post in posts_lists if (ctx.channel.id, post[2]) not in self.recent_posts]
+        random_post = choice(fresh_posts or posts_lists)
+        self.recent_posts.add((ctx.channel.id, random_post[2]))
 
-    #This command is for one piece posts
-    @commands.command()
-    async def slayer(self, ctx: commands.Context):
-        """generate a random demon slayer meme from the reddit"""
-        subreddit = await self.reddit.subreddit("memes")
-        posts_lists = []
-
-        async for post in subreddit.search("Demon Slayer", limit=30):
-            if not post.over_18 and post.author is not None and any(post.url.endswith(ext) for ext in [".png",".jpg",".jpeg",".gif"]):
-                author_name = post.author.name
-                posts_lists.append((post.url, author_name))
-            if post.author is None:
-                posts_lists.append((posts_lists, "N/A"))
-
-        if posts_lists:
-
-            random_post = choice(posts_lists)
-
-            meme_embed = discord.Embed(title="Random Meme", description="Fetches random meme for r/demonslayer", color= discord.Color.random())
-            meme_embed.set_author(name=f"Meme requested by {ctx.author.name}", icon_url=ctx.author.avatar)
-            meme_embed.set_image(url=random_post[0])
-            meme_embed.set_footer(text=f"Post created by {random_post[1]}.", icon_url=None)
-            await ctx.send(embed = meme_embed)
-
-        else:
-            await ctx.send("Unable to fetch post, try again later.")
+        meme_embed = discord.Embed(title="Random Meme", description=f"Fetches random meme for {feed.label}", color= discord.Color.random())
+        meme_embed.set_author(name=f"Meme requested by {ctx.author.name}", icon_url=ctx.author.avatar)
+        meme_embed.set_image(url=random_post[0])
+        meme_embed.set_footer(text=f"Post created by {random_post[1]}.", icon_url=None)
+        await ctx.send(embed = meme_embed)
 
 
-    def cog_unload(self):
-        self.bot.loop.create_task(self.reddit.close())
+    async def cog_unload(self):
+        # awaited, so the HTTP session is really closed before the bot goes away
+        if self.reddit is not None and not self.handed_over:
+            try:
+                await asyncio.wait_for(self.reddit.close(), lifecycle.remaining())
+            except asyncio.TimeoutError:
+                print("Reddit session did not close in time.")
 
 async def setup(bot):
-    await bot.add_cog(Leisure(bot))
\ No newline at end of file
+    await bot.add_cog(Leisure(bot))
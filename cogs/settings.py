@@ -0,0 +1,86 @@
+import discord
+from discord.ext import commands
+
+from utils import queries
+from utils.guilds import FEATURES, GuildSettings, settings
+from utils.lifecycle import PooledCog
+
+
+# Per-guild configuration: the announcement channel, the command prefix and which features are turned on.
+# Settings live in memory, every change is written to the database first and then swapped into the store.
+class GuildConfig(PooledCog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    # the settings themselves live in utils.guilds and survive a reload, so they are only read on a fresh start
+    async def setup_database(self):
+        async with self.pool.acquire() as conn:
+            await conn.execute('''
+            CREATE TABLE IF NOT EXISTS guild_settings (
+                guild_id BIGINT PRIMARY KEY,
+                announce_channel_id BIGINT,
+                prefix TEXT,
+                disabled_features TEXT[] NOT NULL DEFAULT '{}'
+            )
+            ''')
+            settings.load(await queries.fetch(conn, "guild_settings.all"))
+
+    async def cog_check(self, ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        if not ctx.author.guild_permissions.manage_guild:
+            raise commands.MissingPermissions(["manage_guild"])
+        return True
+
+    # writes the new settings and only then makes them visible to the rest of the bot
+    async def save(self, new_settings):
+        async with self.pool.acquire() as conn:
+            await queries.execute(conn, "guild_settings.save", new_settings.guild_id, new_settings.announce_channel_id,
+                                  new_settings.prefix, sorted(new_settings.disabled_features))
+        settings.put(new_settings)
+
+    @commands.command(name="settings")
+    async def show_settings(self, ctx):
+        """shows this server's bot settings"""
+        current = settings.get(ctx.guild.id)
+        channel = ctx.guild.get_channel(current.announce_channel_id) if current.announce_channel_id else None
+
+        embed = discord.Embed(title=f"Settings for {ctx.guild.name}", color=discord.Color.blurple())
+        embed.add_field(name="Prefix", value=settings.prefix_for(ctx.guild.id), inline=True)
+        embed.add_field(name="Announcements", value=channel.mention if channel else "not set", inline=True)
+        embed.add_field(
+            name="Features",
+            value="\n".join(f"{'❌' if feature in current.disabled_features else '✅'} {feature}" for feature in FEATURES),
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="set_announce_channel")
+    async def set_announce_channel(self, ctx, channel: discord.TextChannel = None):
+        """sets the channel level-ups are announced in, leave it out to turn announcements back to the default"""
+        current = settings.get(ctx.guild.id)
+        await self.save(GuildSettings(ctx.guild.id, channel.id if channel else None, current.prefix, current.disabled_features))
+        await ctx.send(f"Announcements will go to {channel.mention}." if channel else "Announcement channel cleared.")
+
+    @commands.command(name="set_prefix")
+    async def set_prefix(self, ctx, prefix: str):
+        """changes the command prefix for this server"""
+        current = settings.get(ctx.guild.id)
+        await self.save(GuildSettings(ctx.guild.id, current.announce_channel_id, prefix, current.disabled_features))
+        await ctx.send(f"The prefix is now `{prefix}`.")
+
+    @commands.command(name="toggle_feature")
+    async def toggle_feature(self, ctx, feature: str):
+        """turns a group of commands on or off for this server"""
+        feature = feature.lower()
+        if feature not in FEATURES:
+            await ctx.send(f"Unknown feature. You can toggle {', '.join(repr(name) for name in FEATURES)}.")
+            return
+
+        current = settings.get(ctx.guild.id)
+        disabled = current.disabled_features ^ {feature}
+        await self.save(GuildSettings(ctx.guild.id, current.announce_channel_id, current.prefix, disabled))
+        await ctx.send(f"The {feature} commands are now {'off' if feature in disabled else 'on'}.")
+
+async def setup(bot):
+    await bot.add_cog(GuildConfig(bot))
@@ -1,141 +1,223 @@
 import discord
 from discord.ext import commands, tasks
-import asyncpg
 import asyncio
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import os
+
+from utils import db, queries
+from utils.guilds import guild_id_of
+from utils.lifecycle import PooledCog
+from utils.presence import live
+from utils.profiles import profiles
 
 load_dotenv()
 
-class TimeManagement(commands.Cog):
+# Periods view_productivity accepts, mapped to how far back the report goes.
+REPORT_PERIODS = {
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+}
+
+# A running timer, timer_id is the row in the timers table it will be written back to.
+class TimerSession:
+    __slots__ = ("timer_id", "task_name", "start_time")
+
+    def __init__(self, timer_id, task_name, start_time):
+        self.timer_id = timer_id
+        self.task_name = task_name
+        self.start_time = start_time
+
+class TimeManagement(PooledCog):
+    feature = "time"
+
     def __init__(self, bot):
         self.bot = bot
-        self.bot.loop.create_task(self.setup_database())
-        self.running_timers = {}  # Store active timers: {user_id: (start_time, task_name)}
+        self.running_timers = {}  # Store active timers: {(guild_id, user_id): TimerSession}
 
-    async def setup_database(self):
-        db_user = os.getenv('DB_USER')
-        db_password = os.getenv('DB_PASSWORD')
-        db_name = os.getenv('DB_NAME')
-        db_host = os.getenv('DB_HOST')
-        db_port = os.getenv('DB_PORT')
-        # Connect to the database
-        self.pool = await asyncpg.create_pool(
-            user=db_user,
-            password=db_password,
-            database=db_name,
-            host=db_host,
-            port=db_port
-        )
+    # after a reload the previous instance hands over its timers, nothing has to be read back
+    def extra_state(self):
+        return {"running_timers": self.running_timers}
+
+    def import_state(self, state):
+        self.running_timers = state["running_timers"]
+        live.active_timers = len(self.running_timers)
 
+    async def setup_database(self):
         # Create necessary tables
         async with self.pool.acquire() as conn:
             await conn.execute('''
             CREATE TABLE IF NOT EXISTS time_management (
-                user_id BIGINT PRIMARY KEY,
+                guild_id BIGINT NOT NULL DEFAULT 0,
+                user_id BIGINT,
                 timex INTEGER DEFAULT 0,
-                daily_goal_complete BOOLEAN DEFAULT FALSE
+                daily_goal_complete BOOLEAN DEFAULT FALSE,
+                PRIMARY KEY (guild_id, user_id)
             )
             ''')
+            await db.partition_by_guild(conn, "time_management", ("guild_id", "user_id"))
 
             await conn.execute('''
             CREATE TABLE IF NOT EXISTS timers (
+                id BIGSERIAL PRIMARY KEY,
+                guild_id BIGINT NOT NULL DEFAULT 0,
                 user_id BIGINT,
                 task_name TEXT,
                 start_time TIMESTAMP,
                 duration INTEGER, -- In minutes
-                completed BOOLEAN DEFAULT FALSE,
-                PRIMARY KEY (user_id, task_name)
+                completed BOOLEAN DEFAULT FALSE
             )
             ''')
 
+            # Older databases keyed timers by (user_id, task_name), which kept only the first run of a task.
+            # Their unfinished rows are timers that were running whenever that bot restarted, they are closed
+            # with no time rather than recovered and paid out from a start time that may be months old.
+            await conn.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = current_schema() AND table_name = 'timers' AND column_name = 'id'
+                ) THEN
+                    UPDATE timers SET completed = TRUE, duration = 0 WHERE NOT completed;
+                    ALTER TABLE timers ADD COLUMN id BIGSERIAL;
+                    ALTER TABLE timers DROP CONSTRAINT IF EXISTS timers_pkey;
+                    ALTER TABLE timers ADD PRIMARY KEY (id);
+                END IF;
+            END
+            $$
+            ''')
+
+            await db.partition_by_guild(conn, "timers")
+
+            # Only running timers are indexed, so recovery looks at what is active rather than the whole history
+            await conn.execute('''
+            DROP INDEX IF EXISTS timers_active_idx
+            ''')
+            await conn.execute('''
+            CREATE INDEX IF NOT EXISTS timers_running_idx ON timers (guild_id, user_id, start_time) WHERE NOT completed
+            ''')
+
             await conn.execute('''
             CREATE TABLE IF NOT EXISTS schedules (
+                guild_id BIGINT NOT NULL DEFAULT 0,
                 user_id BIGINT,
                 schedule_date DATE,
                 task_name TEXT,
                 task_time TIME,
                 is_weekly BOOLEAN DEFAULT FALSE,
-                PRIMARY KEY (user_id, schedule_date, task_name)
+                PRIMARY KEY (guild_id, user_id, schedule_date, task_name)
             )
             ''')
-
-    async def update_timex(self, user_id, points_to_add):
-        async with self.pool.acquire() as conn:
-            result = await conn.fetchrow("SELECT timex FROM time_management WHERE user_id = $1", user_id)
-            if result is None:
-                await conn.execute("INSERT INTO time_management (user_id, timex) VALUES ($1, $2)", user_id, points_to_add)
-            else:
-                timex = result['timex'] + points_to_add
-                await conn.execute("UPDATE time_management SET timex = $1 WHERE user_id = $2", timex, user_id)
+            await db.partition_by_guild(conn, "schedules", ("guild_id", "user_id", "schedule_date", "task_name"))
+
+        # nothing was handed over, so the running timers come from the database
+        await self.recover_timers()
+
+    # rebuilds the running timers from the database after a restart, only the newest unfinished timer of a user
+    # is still running, older ones are closed so they don't stay in the index of running timers
+    async def recover_timers(self):
+        async with db.unit_of_work(self.pool) as conn:
+            closed = await queries.execute(conn, "timers.close_stale")
+            rows = await queries.fetch(conn, "timers.active")
+        if closed != "UPDATE 0":
+            print(f"Closed stale timers on startup: {closed}")
+
+        self.running_timers = {
+            (row['guild_id'], row['user_id']): TimerSession(row['id'], row['task_name'], row['start_time'])
+            for row in rows
+        }
+        live.active_timers = len(self.running_timers)
+
+    # adds Timex on the connection of the calling command and returns the new total
+    async def update_timex(self, conn, guild_id, user_id, points_to_add):
+        return await queries.fetchval(conn, "timex.add", guild_id, user_id, points_to_add)
 
     @commands.command(name="start_timer")
     async def start_timer(self, ctx, task_name: str):
         """Start a timer for a specific task."""
-        if ctx.author.id in self.running_timers:
+        guild_id = guild_id_of(ctx)
+        key = (guild_id, ctx.author.id)
+        if key in self.running_timers:
             await ctx.send("You already have a running timer. End it before starting a new one.")
             return
 
-        self.running_timers[ctx.author.id] = (datetime.utcnow(), task_name)
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO timers (user_id, task_name, start_time) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING",
-                ctx.author.id, task_name, datetime.utcnow()
-            )
+        # The session is claimed before the insert so a second start_timer can't slip in while it runs
+        session = TimerSession(None, task_name, datetime.utcnow())
+        self.running_timers[key] = session
+        live.timer_started()
+        try:
+            async with self.pool.acquire() as conn:
+                session.timer_id = await queries.fetchval(conn, "timers.start", guild_id, ctx.author.id, task_name, session.start_time)
+        except Exception:
+            self.running_timers.pop(key, None)
+            live.timer_ended()
+            raise
 
         await ctx.send(f"Timer started for task: `{task_name}`.")
 
     @commands.command(name="check_timer")
     async def check_timer(self, ctx):
         """Check how much time is left on a task timer."""
-        timer = self.running_timers.get(ctx.author.id)
+        timer = self.running_timers.get((guild_id_of(ctx), ctx.author.id))
         if not timer:
             await ctx.send("You don't have any running timers.")
             return
 
-        start_time, task_name = timer
-        elapsed = datetime.utcnow() - start_time
+        elapsed = datetime.utcnow() - timer.start_time
         minutes_elapsed = elapsed.total_seconds() // 60
 
-        await ctx.send(f"Task `{task_name}` has been running for {minutes_elapsed:.0f} minutes.")
+        await ctx.send(f"Task `{timer.task_name}` has been running for {minutes_elapsed:.0f} minutes.")
 
     @commands.command(name="end_timer")
     async def end_timer(self, ctx):
         """End a running timer and calculate Timex points."""
-        timer = self.running_timers.pop(ctx.author.id, None)
+        guild_id = guild_id_of(ctx)
+        key = (guild_id, ctx.author.id)
+        timer = self.running_timers.get(key)
         if not timer:
             await ctx.send("You don't have any running timers to end.")
             return
+        # start_timer is still writing the row, ending it now would finish nothing and leave the row running
+        if timer.timer_id is None:
+            await ctx.send("Your timer is still starting, try again in a moment.")
+            return
+        del self.running_timers[key]
+        live.timer_ended()
 
-        start_time, task_name = timer
-        elapsed = datetime.utcnow() - start_time
+        elapsed = datetime.utcnow() - timer.start_time
         minutes_elapsed = int(elapsed.total_seconds() // 60)
 
         # Calculate Timex points
         points = minutes_elapsed + (10 if minutes_elapsed > 0 else 0) + (5 if minutes_elapsed > 60 else 0)
-        await self.update_timex(ctx.author.id, points)
 
-        # Update database
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE timers SET duration = $1, completed = TRUE WHERE user_id = $2 AND task_name = $3",
-                minutes_elapsed, ctx.author.id, task_name
-            )
-
-        await ctx.send(f"Timer for `{task_name}` ended. You earned {points} Timex!")
+        # Update database, the timer and the Timex are written together or not at all
+        version = profiles.begin_write(guild_id, ctx.author.id)
+        try:
+            async with db.unit_of_work(self.pool) as conn:
+                await queries.execute(conn, "timers.finish", minutes_elapsed, timer.timer_id)
+                timex = await self.update_timex(conn, guild_id, ctx.author.id, points)
+        except Exception:
+            # nothing was written, so the timer keeps running
+            if self.running_timers.setdefault(key, timer) is timer:
+                live.timer_started()
+            raise
+        db.forget(key)
+        profiles.update(guild_id, ctx.author.id, version, timex=timex)
+
+        await ctx.send(f"Timer for `{timer.task_name}` ended. You earned {points} Timex!")
 
     @commands.command(name="set_schedule")
     async def set_schedule(self, ctx, task_name: str, time: str, is_weekly: bool = False):
         """Set a daily or weekly schedule for tasks."""
         task_time = datetime.strptime(time, "%H:%M").time()
         schedule_date = datetime.utcnow().date()
+        guild_id = guild_id_of(ctx)
 
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                "INSERT INTO schedules (user_id, schedule_date, task_name, task_time, is_weekly) VALUES ($1, $2, $3, $4, $5)",
-                ctx.author.id, schedule_date, task_name, task_time, is_weekly
-            )
+            await queries.execute(conn, "schedules.insert", guild_id, ctx.author.id, schedule_date, task_name, task_time, is_weekly)
+        db.forget((guild_id, ctx.author.id))
 
         await ctx.send(f"Schedule set for `{task_name}` at {time} {'weekly' if is_weekly else 'daily'}.")
 
@@ -143,11 +225,8 @@ class TimeManagement(commands.Cog):
     async def view_schedule(self, ctx):
         """View the user's schedule for the day or week."""
         today = datetime.utcnow().date()
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                "SELECT task_name, task_time, is_weekly FROM schedules WHERE user_id = $1 AND (schedule_date = $2 OR is_weekly = TRUE)",
-                ctx.author.id, today
-            )
+        guild_id = guild_id_of(ctx)
+        rows = await db.fetch_shared(self.pool, (guild_id, ctx.author.id), "schedules.for_day", guild_id, ctx.author.id, today)
 
         if not rows:
             await ctx.send("You don't have any scheduled tasks.")
@@ -182,7 +261,8 @@ class TimeManagement(commands.Cog):
 
         await ctx.send(f"Reminder set for `{reminder_text}` at {time}.")
 
-    @commands.command(name="pomodoro")
+    # half an hour of sleeping, shutdown doesn't wait for it
+    @commands.command(name="pomodoro", extras={"long_running": True})
     async def pomodoro(self, ctx):
         """Start a Pomodoro timer (25 minutes work, 5 minutes break)."""
         await ctx.send("Starting a Pomodoro timer: 25 minutes of work starting now!")
@@ -195,11 +275,13 @@ class TimeManagement(commands.Cog):
     @commands.command(name="view_productivity")
     async def view_productivity(self, ctx, period: str = "week"):
         """View productivity report."""
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(
-                f"SELECT task_name, duration FROM timers WHERE user_id = $1 AND completed = TRUE AND start_time > (NOW() - INTERVAL '1 {period}')",
-                ctx.author.id
-            )
+        window = REPORT_PERIODS.get(period)
+        if window is None:
+            await ctx.send(f"Invalid period. You can use {', '.join(repr(name) for name in REPORT_PERIODS)}.")
+            return
+
+        guild_id = guild_id_of(ctx)
+        rows = await db.fetch_shared(self.pool, (guild_id, ctx.author.id), "timers.completed_since", guild_id, ctx.author.id, window)
 
         if not rows:
             await ctx.send(f"No tasks completed in the past {period}.")
@@ -219,16 +301,16 @@ class TimeManagement(commands.Cog):
     @commands.command(name="daily_goal")
     async def daily_goal(self, ctx):
         """Set and reward for daily goal completion."""
+        guild_id = guild_id_of(ctx)
+        version = profiles.begin_write(guild_id, ctx.author.id)
         async with self.pool.acquire() as conn:
-            result = await conn.fetchrow("SELECT daily_goal_complete FROM time_management WHERE user_id = $1", ctx.author.id)
-            if result and result['daily_goal_complete']:
-                await ctx.send("You have already completed your daily goal today!")
-                return
-
-            await conn.execute(
-                "UPDATE time_management SET timex = timex + 50, daily_goal_complete = TRUE WHERE user_id = $1",
-                ctx.author.id
-            )
+            timex = await queries.fetchval(conn, "daily_goal.complete", guild_id, ctx.author.id, 50)
+        db.forget((guild_id, ctx.author.id))
+
+        if timex is None:
+            await ctx.send("You have already completed your daily goal today!")
+            return
+        profiles.update(guild_id, ctx.author.id, version, timex=timex)
         await ctx.send("Congratulations on completing your daily goal! You earned 50 Timex.")
 
     @commands.command(name="delete_schedule")
@@ -237,18 +319,17 @@ class TimeManagement(commands.Cog):
         try:
             # Convert the string time to datetime object and extract time
             task_time = datetime.strptime(time, "%H:%M").time()
+            guild_id = guild_id_of(ctx)
 
             async with self.pool.acquire() as conn:
                 # Delete the schedule from the database where the task_name and task_time match
-                result = await conn.execute(
-                    "DELETE FROM schedules WHERE user_id = $1 AND task_name = $2 AND task_time = $3",
-                    ctx.author.id, task_name, task_time
-                )
-
-                if result == "DELETE 0":
-                    await ctx.send(f"No schedule found for task '{task_name}' at {time}.")
-                else:
-                    await ctx.send(f"Schedule for task '{task_name}' at {time} has been deleted.")
+                result = await queries.execute(conn, "schedules.delete", guild_id, ctx.author.id, task_name, task_time)
+            db.forget((guild_id, ctx.author.id))
+
+            if result == "DELETE 0":
+                await ctx.send(f"No schedule found for task '{task_name}' at {time}.")
+            else:
+                await ctx.send(f"Schedule for task '{task_name}' at {time} has been deleted.")
         except Exception as e:
             await ctx.send(f"An error occurred while deleting the schedule: {e}")
             print(e)
@@ -1,14 +1,19 @@
 import discord
 from discord.ext import commands, tasks
-from itertools import cycle
 import requests
 import json
 import os
 import asyncio
+import signal
 import threading
+import traceback
 from flask import Flask
 from dotenv import load_dotenv
 
+from utils import guilds, presence, queries, ratelimit
+from utils.announce import announcements
+from utils.lifecycle import ShuttingDown, lifecycle
+
 # Load environment variables from the .env file
 load_dotenv()
 
@@ -19,27 +24,89 @@ intents.message_content = True  # Allow content of messages to be read
 intents.guilds = True
 intents.members = True
 
+# Each guild can pick its own prefix, it is looked up in the in-memory guild settings for every message
+def get_prefix(bot, message):
+    return guilds.settings.prefix_for(guilds.guild_id_of(message))
+
+# How often a user repeating commands of a turned-off feature is told so, in seconds
+FEATURE_DISABLED_REPLY_INTERVAL = 10
+
 # Initializes the bot
-bot = commands.Bot(command_prefix=".", intents=intents)
-
-# This is the collection of the various defined status of the bot
-status = cycle([
-    "Leveling up in real life 🌟",
-    "Your journey to greatness 🚀",
-    "The sound of progress 🎧",
-    "Turning effort into achievement 🛠️"
-])
-
-# Change bot status loop in a specific interval
-@tasks.loop(seconds=20)
+bot = commands.Bot(command_prefix=get_prefix, intents=intents)
+
+# The status rotates through live stats of the bot, see utils/presence.py
+rotator = presence.create_rotator(bot)
+
+# Checks the status in a specific interval, the rotator only sends an update when the text changed
+@tasks.loop(seconds=float(os.getenv("PRESENCE_INTERVAL", "20")))
 async def change_status():
-    await bot.change_presence(activity=discord.Game(next(status)))
+    await rotator.tick()
+
+# Every command is traced so the query catalogue can count its database round trips, and counted as in flight
+# so shutdown can wait for it
+@bot.before_invoke
+async def start_query_trace(ctx):
+    if lifecycle.tracks(ctx.command):
+        lifecycle.started()
+    queries.catalogue.start_trace(ctx.command.qualified_name)
+
+@bot.after_invoke
+async def end_query_trace(ctx):
+    queries.catalogue.end_trace()
+    if lifecycle.tracks(ctx.command):
+        lifecycle.finished()
+
+# Once shutdown started no new command is taken on
+@bot.check_once
+async def not_shutting_down(ctx):
+    if lifecycle.closing:
+        raise ShuttingDown()
+    return True
+
+# Guilds can turn off whole cogs, a cog's `feature` attribute names the toggle it belongs to.
+# Checked before the rate limit, so commands that won't run don't use up anyone's tokens
+@bot.check_once
+async def feature_enabled(ctx):
+    feature = getattr(ctx.cog, "feature", None)
+    if feature and not guilds.settings.is_enabled(guilds.guild_id_of(ctx), feature):
+        raise guilds.FeatureDisabled(feature)
+    return True
+
+# Bot-wide rate limit, every command takes a token from the user's, the guild's and the user's bucket for that command
+@bot.check_once
+async def rate_limit(ctx):
+    guild_id = ctx.guild.id if ctx.guild else None
+    retry_after = await ratelimit.limiter.hit(ctx.author.id, guild_id, ctx.command.qualified_name)
+    if retry_after:
+        raise ratelimit.RateLimited(retry_after)
+    return True
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, ratelimit.RateLimited):
+        # only the first rejection until the buckets refill gets an answer, the rest are dropped silently
+        if ratelimit.limiter.should_warn(ctx.author.id, error.retry_after):
+            await ctx.send(f"Slow down {ctx.author.mention}, try again in {error.retry_after:.1f}s.", delete_after=min(error.retry_after, 10))
+        return
+    if isinstance(error, guilds.FeatureDisabled):
+        # these skip the rate limit, so a user repeating a disabled command is answered once in a while, not every time
+        if ratelimit.limiter.should_warn(ctx.author.id, FEATURE_DISABLED_REPLY_INTERVAL):
+            await ctx.send(str(error))
+        return
+    if isinstance(error, ShuttingDown):
+        await ctx.send(str(error))
+        return
+    # anything else is reported like discord.py does when there is no handler
+    print(f"Ignoring exception in command {ctx.command}:")
+    traceback.print_exception(type(error), error, error.__traceback__)
 
 # Prints a message when the bot is ready
 @bot.event
 async def on_ready():
     print(f"{bot.user} is ready!")
-    change_status.start()
+    # on_ready fires again after a reconnect, the loop is already running then
+    if not change_status.is_running():
+        change_status.start()
 
 # Basic hello command to check the activity of the bot (pre-production)
 @bot.command()
@@ -54,7 +121,7 @@ async def quote(ctx):
     await ctx.send(get_quote())
 
 def get_quote():
-    response = requests.get("https://zenquotes.io/api/random")
+    response = requests.get(os.getenv("ZENQUOTES_URL", "https://zenquotes.io/api/random"))
     json_data = json.loads(response.text)
     quote = f"{json_data[0]['q']} - {json_data[0]['a']}"
     return quote
@@ -76,10 +143,45 @@ def home():
 def run_flask():
     app.run(host="0.0.0.0", port=80)
 
+# Orderly shutdown: stop taking commands, let the running ones finish, send what is still queued and close
+# every pool and HTTP session, all within SHUTDOWN_TIMEOUT seconds
+async def shutdown():
+    if not lifecycle.begin_shutdown():
+        return
+    print("Shutting down...")
+    change_status.cancel()
+
+    still_running = await lifecycle.drain()
+    if still_running:
+        print(f"{still_running} commands were still running at the shutdown deadline.")
+
+    try:
+        await asyncio.wait_for(announcements.close(), lifecycle.remaining())
+    except asyncio.TimeoutError:
+        print(f"{announcements.pending} announcements could not be sent before the shutdown deadline.")
+
+    # unloading the cogs closes their database pools and the reddit session
+    for extension in list(bot.extensions):
+        try:
+            await bot.unload_extension(extension)
+        except Exception:
+            print(f"Failed to unload {extension}:")
+            traceback.print_exc()
+
+    await ratelimit.limiter.close()
+    await bot.close()
+
 # Main function to run both Flask and Discord bot
 async def main():
-    # Run Flask server in a separate thread
-    threading.Thread(target=run_flask).start()
+    # Run Flask server in a separate thread, as a daemon so it doesn't keep the process alive after shutdown
+    threading.Thread(target=run_flask, daemon=True).start()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(shutdown()))
+        except NotImplementedError:
+            pass  # Windows, Ctrl+C still stops the bot there, just without the orderly shutdown
 
     async with bot:
         await load_cogs()
@@ -0,0 +1,68 @@
+import asyncio
+
+
+# Queue for bot announcements such as level-ups. Messages for the same channel that arrive within `interval`
+# seconds are joined into as few messages as fit Discord's length limit, and sends are spaced out, so a burst
+# of level-ups turns into a couple of messages instead of tripping the rate limit.
+class AnnouncementQueue:
+    def __init__(self, interval=2.0, spacing=0.5, max_length=2000):
+        self.interval = interval
+        self.spacing = spacing
+        self.max_length = max_length
+        self._pending = {}  # channel id -> (channel, [lines])
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def put(self, channel, text):
+        if channel.id in self._pending:
+            self._pending[channel.id][1].append(text)
+        else:
+            self._pending[channel.id] = (channel, [text])
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        self._wakeup.set()
+
+    @property
+    def pending(self):
+        return sum(len(lines) for _, lines in self._pending.values())
+
+    def _batches(self, lines):
+        batch = ""
+        for line in lines:
+            if batch and len(batch) + 1 + len(line) > self.max_length:
+                yield batch
+                batch = ""
+            batch = f"{batch}\n{line}" if batch else line[:self.max_length]
+        if batch:
+            yield batch
+
+    async def flush(self):
+        """sends everything that is queued right now"""
+        while self._pending:
+            channel, lines = self._pending.pop(next(iter(self._pending)))
+            for batch in self._batches(lines):
+                try:
+                    await channel.send(batch)
+                except Exception as e:
+                    print(f"Failed to send an announcement to channel {channel.id}: {e}")
+                await asyncio.sleep(self.spacing)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await asyncio.sleep(self.interval)  # let the rest of the burst arrive
+            await self.flush()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+announcements = AnnouncementQueue()
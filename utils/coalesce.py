@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+
+class _Shared:
+    __slots__ = ("task", "expires")
+
+    def __init__(self, task):
+        self.task = task
+        self.expires = None  # set once the task finished, until then every caller joins it
+
+
+# Lets identical read-only lookups share one result. Calls with the same scope and key that arrive while
+# the first one is running, or within `window` seconds after it finished, get that call's result instead
+# of running their own. The scope is whoever owns the data (a guild and user), writes forget it.
+class Coalescer:
+    def __init__(self, window):
+        self.window = window
+        self._scopes = {}
+        self._next_sweep = 0.0
+        self.shared = 0
+        self.started = 0
+
+    async def run(self, scope, key, factory):
+        entries = self._scopes.setdefault(scope, {})
+        entry = entries.get(key)
+        if entry is not None and (entry.expires is None or entry.expires > time.monotonic()):
+            self.shared += 1
+            return await asyncio.shield(entry.task)
+
+        self.started += 1
+        entry = _Shared(asyncio.ensure_future(factory()))
+        entries[key] = entry
+        try:
+            result = await asyncio.shield(entry.task)
+        except BaseException:
+            if entries.get(key) is entry:
+                del entries[key]
+            raise
+        entry.expires = time.monotonic() + self.window
+        self._sweep()
+        return result
+
+    def forget(self, scope):
+        """drops whatever is shared for this scope, called after a write so the next read sees it"""
+        self._scopes.pop(scope, None)
+
+    # expired results are dropped lazily, at most once per window
+    def _sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.window
+        for scope in list(self._scopes):
+            entries = self._scopes[scope]
+            for key in [key for key, entry in entries.items() if entry.expires is not None and entry.expires <= now]:
+                del entries[key]
+            if not entries:
+                del self._scopes[scope]
@@ -0,0 +1,108 @@
+import asyncio
+import asyncpg
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+import os
+
+from utils import queries
+from utils.coalesce import Coalescer
+
+load_dotenv()
+
+# Optional replacement for the real connection pool, the benchmark harness installs its in-process stand-in here.
+_pool_factory = None
+
+
+def set_pool_factory(factory):
+    """installs an async callable that returns a pool-like object, or None to go back to postgres"""
+    global _pool_factory
+    _pool_factory = factory
+
+
+# Identical read-only lookups within this many seconds of each other share one database call.
+coalescer = Coalescer(float(os.getenv("COALESCE_WINDOW", "2")))
+
+
+# creates a connection pool with the access credentials from the .env file
+async def create_pool():
+    if _pool_factory is not None:
+        return await _pool_factory()
+
+    return await asyncpg.create_pool(
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        database=os.getenv('DB_NAME'),
+        host=os.getenv('DB_HOST'),
+        port=os.getenv('DB_PORT')
+    )
+
+
+# closes a pool, connections still in use after `timeout` seconds are cut off
+async def close_pool(pool, timeout):
+    try:
+        await asyncio.wait_for(pool.close(), timeout)
+    except asyncio.TimeoutError:
+        print("Database pool did not close in time, terminating its connections.")
+        pool.terminate()
+
+
+# Runs every statement of a command on one connection inside one transaction, so a failure halfway
+# leaves nothing behind and the command never waits on the pool twice.
+@asynccontextmanager
+async def unit_of_work(pool):
+    async with pool.acquire() as conn:
+        queries.catalogue.note("BEGIN")
+        async with conn.transaction():
+            yield conn
+        queries.catalogue.note("COMMIT")
+
+
+async def _read(pool, method, name, args):
+    async with pool.acquire() as conn:
+        return await getattr(queries, method)(conn, name, *args)
+
+
+# Read-only lookups of data owned by `scope` (a (guild id, user id) pair). Repeats of the same statement and arguments inside
+# the coalescing window reuse the first result, write paths call forget(scope) so they don't see stale rows.
+async def fetch_shared(pool, scope, name, *args):
+    return await coalescer.run(scope, (name, args), lambda: _read(pool, "fetch", name, args))
+
+
+async def fetchrow_shared(pool, scope, name, *args):
+    return await coalescer.run(scope, (name, args), lambda: _read(pool, "fetchrow", name, args))
+
+
+def forget(scope):
+    coalescer.forget(scope)
+
+
+# Moves a table that was keyed by user only to one partitioned by guild. Rows from before that belong to
+# LEGACY_GUILD_ID (the bot used to serve a single server). A table that still has rows to move refuses to
+# migrate until it is set, guessing would file everyone's data under the wrong server; set it to 0 to move
+# them to direct messages on purpose.
+# Table and column names are constants from the cogs, never user input.
+async def partition_by_guild(conn, table, primary_key=None):
+    partitioned = await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = $1 AND column_name = 'guild_id')",
+        table,
+    )
+    if partitioned is None or partitioned:
+        return
+
+    rows = await conn.fetchval(f"SELECT COUNT(*) FROM {table}")
+    legacy_guild_id = os.getenv("LEGACY_GUILD_ID")
+    if rows and legacy_guild_id is None:
+        raise RuntimeError(
+            f"{table} has {rows} rows from before data was kept per server. Set LEGACY_GUILD_ID to the id of "
+            f"the server the bot ran in (or to 0 to move them to direct messages) and restart."
+        )
+    legacy_guild_id = int(legacy_guild_id or 0)
+    print(f"Moving {rows} {table} rows to guild {legacy_guild_id}")
+
+    async with conn.transaction():
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN guild_id BIGINT NOT NULL DEFAULT {legacy_guild_id}")
+        await conn.execute(f"ALTER TABLE {table} ALTER COLUMN guild_id SET DEFAULT 0")
+        if primary_key:
+            await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_pkey")
+            await conn.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(primary_key)})")
@@ -0,0 +1,57 @@
+import json
+import re
+
+DEFAULT_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif")
+LISTING_SORTS = ("hot", "new", "top", "rising", "controversial")
+SEARCH_SORTS = ("relevance", "hot", "top", "new", "comments")
+
+
+# A single reddit feed as described in feeds.json. Everything the filter needs is worked out once here,
+# so fetching a post only has to run the precompiled checks in `matches`.
+class Feed:
+    __slots__ = ("name", "help", "label", "subreddit", "query", "sort", "limit", "allow_nsfw", "extensions", "title_pattern")
+
+    def __init__(self, name, subreddit, label=None, help=None, query=None, sort=None, limit=30,
+                 allow_nsfw=False, extensions=DEFAULT_EXTENSIONS, title_pattern=None):
+        self.name = name
+        self.help = help or f"generates a random post from r/{subreddit}."
+        self.label = label or f"r/{subreddit}"
+        self.subreddit = subreddit
+        self.query = query
+        self.sort = sort or ("relevance" if query else "hot")
+        self.limit = int(limit)
+        self.allow_nsfw = bool(allow_nsfw)
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.title_pattern = re.compile(title_pattern, re.IGNORECASE) if title_pattern else None
+
+        allowed_sorts = SEARCH_SORTS if query else LISTING_SORTS
+        if self.sort not in allowed_sorts:
+            raise ValueError(f"Feed '{name}' has an unknown sort '{self.sort}', expected one of {', '.join(allowed_sorts)}.")
+
+    # returns the listing generator for this feed from an asyncpraw subreddit
+    def listing(self, subreddit):
+        if self.query:
+            return subreddit.search(self.query, sort=self.sort, limit=self.limit)
+        return getattr(subreddit, self.sort)(limit=self.limit)
+
+    # single check for a post, deleted authors and nsfw posts are dropped before the url is looked at
+    def matches(self, post):
+        if post.author is None or (post.over_18 and not self.allow_nsfw):
+            return False
+        if not post.url.lower().endswith(self.extensions):
+            return False
+        return self.title_pattern is None or self.title_pattern.search(post.title) is not None
+
+
+# Reads the feed registry, returns the dedup window size and the feeds keyed by command name.
+def load_feeds(path):
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+
+    feeds = {}
+    for entry in config.get("feeds", []):
+        feed = Feed(**entry)
+        if feed.name in feeds:
+            raise ValueError(f"Feed '{feed.name}' is defined more than once in {path}.")
+        feeds[feed.name] = feed
+    return int(config.get("recent_posts", 512)), feeds
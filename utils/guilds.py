@@ -0,0 +1,58 @@
+from discord.ext import commands
+
+# Per-guild settings, loaded from the guild_settings table when the GuildConfig cog starts and kept in memory,
+# so the prefix lookup and the feature check on every message never touch the database.
+
+DEFAULT_PREFIX = "."
+FEATURES = ("fitness", "goals", "time", "leisure")  # matched against the `feature` attribute of the cogs
+
+
+class FeatureDisabled(commands.CheckFailure):
+    def __init__(self, feature):
+        super().__init__(f"The {feature} commands are turned off in this server.")
+        self.feature = feature
+
+
+class GuildSettings:
+    __slots__ = ("guild_id", "announce_channel_id", "prefix", "disabled_features")
+
+    def __init__(self, guild_id, announce_channel_id=None, prefix=None, disabled_features=()):
+        self.guild_id = guild_id
+        self.announce_channel_id = announce_channel_id
+        self.prefix = prefix
+        self.disabled_features = frozenset(disabled_features)
+
+
+class GuildSettingsStore:
+    def __init__(self):
+        self._settings = {}
+
+    def get(self, guild_id):
+        """returns the settings of a guild, or defaults when it never changed any"""
+        return self._settings.get(guild_id) or GuildSettings(guild_id)
+
+    def load(self, rows):
+        self._settings = {
+            row['guild_id']: GuildSettings(row['guild_id'], row['announce_channel_id'], row['prefix'], row['disabled_features'])
+            for row in rows
+        }
+
+    def put(self, settings):
+        self._settings[settings.guild_id] = settings
+
+    def prefix_for(self, guild_id):
+        settings = self._settings.get(guild_id)
+        return settings.prefix if settings is not None and settings.prefix else DEFAULT_PREFIX
+
+    def is_enabled(self, guild_id, feature):
+        settings = self._settings.get(guild_id)
+        return settings is None or feature not in settings.disabled_features
+
+
+settings = GuildSettingsStore()
+
+
+# Data is partitioned by guild, direct messages (and rows from before guilds were tracked) use guild 0.
+def guild_id_of(source):
+    guild = getattr(source, "guild", None)
+    return guild.id if guild is not None else 0
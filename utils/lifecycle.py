@@ -0,0 +1,132 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from discord.ext import commands
+from dotenv import load_dotenv
+
+from utils import db
+
+load_dotenv()
+
+
+class ShuttingDown(commands.CheckFailure):
+    def __init__(self):
+        super().__init__("The bot is restarting, try again in a moment.")
+
+
+# Keeps track of the commands that are running so shutdown can wait for them, and of the deadline
+# everything has to be closed by once shutdown started.
+class Lifecycle:
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.closing = False
+        self._deadline = None
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @staticmethod
+    def tracks(command):
+        """commands marked with extras={"long_running": True} (pomodoro) are not waited for on shutdown"""
+        return not command.extras.get("long_running")
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def started(self):
+        self._in_flight += 1
+        self._idle.clear()
+
+    def finished(self):
+        self._in_flight -= 1
+        if self._in_flight <= 0:
+            self._in_flight = 0
+            self._idle.set()
+
+    @asynccontextmanager
+    async def track(self):
+        """counts the block as a running command, for entry points that are not commands"""
+        self.started()
+        try:
+            yield
+        finally:
+            self.finished()
+
+    def begin_shutdown(self):
+        """stops new commands and starts the shutdown clock, returns False when shutdown already started"""
+        if self.closing:
+            return False
+        self.closing = True
+        self._deadline = asyncio.get_running_loop().time() + self.timeout
+        return True
+
+    def remaining(self):
+        """seconds left until the shutdown deadline, the full timeout while the bot is not shutting down"""
+        if self._deadline is None:
+            return self.timeout
+        return max(0.0, self._deadline - asyncio.get_running_loop().time())
+
+    async def drain(self):
+        """waits for running commands to finish, returns how many were still running at the deadline"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.remaining())
+        except asyncio.TimeoutError:
+            pass
+        return self._in_flight
+
+
+lifecycle = Lifecycle(float(os.getenv("SHUTDOWN_TIMEOUT", "30")))
+
+
+# State a cog hands to its next instance while it is reloaded, keyed by the cog's name. The old instance
+# stashes it from export_state() before the extension is reloaded, the new one claims it in cog_load.
+class Handover:
+    def __init__(self):
+        self._states = {}
+
+    def stash(self, name, state):
+        self._states[name] = state
+
+    def claim(self, name):
+        return self._states.pop(name, None)
+
+
+handover = Handover()
+
+
+# Base for the cogs that keep a database pool. A fresh instance opens a pool and runs setup_database(), one
+# started by .reload takes over the pool and whatever else export_state() handed it instead, so a reload
+# neither reconnects nor reads anything back. The pool is closed on unload unless it was handed over.
+class PooledCog(commands.Cog):
+    pool = None
+    handed_over = False
+
+    async def cog_load(self):
+        state = handover.claim(self.qualified_name)
+        if state is not None:
+            self.pool = state.pop("pool")
+            self.import_state(state)
+            return
+        self.pool = await db.create_pool()
+        await self.setup_database()
+
+    async def cog_unload(self):
+        if self.pool is not None and not self.handed_over:
+            await db.close_pool(self.pool, lifecycle.remaining())
+
+    def export_state(self):
+        """called by .reload right before the extension is reloaded"""
+        self.handed_over = True
+        return {"pool": self.pool, **self.extra_state()}
+
+    async def setup_database(self):
+        """creates the cog's tables, only runs when there was no previous instance to take over from"""
+
+    def extra_state(self):
+        """in-memory state besides the pool that the next instance takes over"""
+        return {}
+
+    def import_state(self, state):
+        """takes over what extra_state() of the previous instance returned"""
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+
+# A set that remembers a bounded number of keys, forgetting the least recently touched one once it is full.
+class LRUSet:
+    __slots__ = ("maxsize", "_keys")
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._keys = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return
+        self._keys[key] = None
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+
+    def discard(self, key):
+        self._keys.pop(key, None)
+
+
+# A dict with the same bounded, least-recently-used eviction.
+class LRUCache:
+    __slots__ = ("maxsize", "_items")
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            return default
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+
+    def clear(self):
+        self._items.clear()
@@ -0,0 +1,84 @@
+import os
+import time
+from datetime import datetime
+
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Counters the presence is built from. The cogs bump them as things happen, so reading them never
+# touches the database.
+class LiveStats:
+    __slots__ = ("active_timers", "_workouts", "_day")
+
+    def __init__(self):
+        self.active_timers = 0
+        self._workouts = 0
+        self._day = None
+
+    def timer_started(self):
+        self.active_timers += 1
+
+    def timer_ended(self):
+        self.active_timers = max(0, self.active_timers - 1)
+
+    def workout_logged(self):
+        self._roll_over()
+        self._workouts += 1
+
+    @property
+    def workouts_today(self):
+        self._roll_over()
+        return self._workouts
+
+    # the workout count starts again at midnight UTC
+    def _roll_over(self):
+        today = datetime.utcnow().date()
+        if today != self._day:
+            self._day = today
+            self._workouts = 0
+
+
+live = LiveStats()
+
+
+# Rotates the bot's presence through the live stats. A shard only gets a gateway update when its text
+# actually changes and no sooner than `min_interval` seconds after its previous update.
+class PresenceRotator:
+    def __init__(self, bot, min_interval=60.0):
+        self.bot = bot
+        self.min_interval = min_interval
+        self._shown = {}  # shard id -> (index of the line, text, time it was sent)
+
+    def lines(self):
+        lines = [f"Serving {len(self.bot.guilds)} servers 🌟"]
+        if live.active_timers:
+            lines.append(f"{live.active_timers} timers running ⏱️")
+        if live.workouts_today:
+            lines.append(f"{live.workouts_today} workouts logged today 💪")
+        return lines
+
+    def _shard_ids(self):
+        if isinstance(self.bot, discord.AutoShardedClient):
+            return list(self.bot.shards)
+        return [None]
+
+    async def tick(self):
+        lines = self.lines()
+        now = time.monotonic()
+        for shard_id in self._shard_ids():
+            index, text, sent_at = self._shown.get(shard_id, (-1, None, 0.0))
+            if text is not None and now - sent_at < self.min_interval:
+                continue
+            index = (index + 1) % len(lines)
+            if lines[index] == text:
+                continue
+            kwargs = {"shard_id": shard_id} if shard_id is not None else {}
+            await self.bot.change_presence(activity=discord.Game(lines[index]), **kwargs)
+            self._shown[shard_id] = (index, lines[index], now)
+
+
+def create_rotator(bot):
+    return PresenceRotator(bot, min_interval=float(os.getenv("PRESENCE_MIN_INTERVAL", "60")))
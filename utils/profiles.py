@@ -0,0 +1,94 @@
+import os
+
+from dotenv import load_dotenv
+
+from utils import db
+from utils.lru import LRUCache
+
+load_dotenv()
+
+FITNESS_FIELDS = ("powerlevel", "strength", "pushup", "pullup", "run", "situp")
+
+
+# Everything the profile views show for one user in one guild. Fitness fields are None until the user logged a workout.
+class Profile:
+    __slots__ = FITNESS_FIELDS + ("timex", "active_goals", "completed_goals")
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row[field])
+
+    @property
+    def has_fitness(self):
+        return self.powerlevel is not None
+
+
+# Read-through cache of profiles. Misses load the whole profile in one round trip; the write paths in
+# Fitness and TimeManagement patch cached profiles in place with the values their statements return,
+# other writes (goals) drop the profile so it is loaded again.
+#
+# Every profile has a version that moves whenever a write to it starts or finishes. A load is only cached
+# when the version didn't move while it ran, and a write only patches the profile when no other write to it
+# started in between, otherwise the profile is dropped, since the patches could land out of commit order.
+class ProfileCache:
+    def __init__(self, maxsize):
+        self._profiles = LRUCache(maxsize)
+        # only needs to outlive the writes and loads in flight, which are far fewer than the cached profiles
+        self._versions = LRUCache(maxsize)
+        self._clock = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _bump(self, key):
+        self._clock += 1
+        self._versions[key] = self._clock
+        return self._clock
+
+    async def get(self, pool, guild_id, user_id):
+        key = (guild_id, user_id)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            self.hits += 1
+            return profile
+
+        self.misses += 1
+        version = self._versions.get(key)
+        profile = Profile(await db.fetchrow_shared(pool, key, "profiles.get", guild_id, user_id))
+        if self._versions.get(key) == version:
+            self._profiles[key] = profile
+        return profile
+
+    def begin_write(self, guild_id, user_id):
+        """call before writing a user's rows, the returned version goes to update() once the write is done"""
+        return self._bump((guild_id, user_id))
+
+    def update(self, guild_id, user_id, version, **fields):
+        """patches a cached profile with freshly written values, does nothing when it isn't cached"""
+        key = (guild_id, user_id)
+        profile = self._profiles.get(key)
+        if profile is not None:
+            if self._versions.get(key) == version:
+                for field, value in fields.items():
+                    setattr(profile, field, value)
+            else:
+                self._profiles.pop(key)  # another write overlapped this one, which of them is newer isn't known here
+        self._bump(key)
+
+    def invalidate(self, guild_id, user_id):
+        """drops a profile after a write to it, for writes that don't return the new values"""
+        key = (guild_id, user_id)
+        self._profiles.pop(key)
+        self._bump(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._profiles),
+            "max_size": self._profiles.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+profiles = ProfileCache(int(os.getenv("PROFILE_CACHE_SIZE", "10000")))
@@ -0,0 +1,201 @@
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Every statement the command handlers send, by name. The SQL text never changes between calls, so
+# asyncpg's per-connection statement cache prepares each one once per connection and reuses it after that.
+# Values only ever travel as $n parameters.
+STATEMENTS = {
+    # time management
+    "timex.add": (
+        "INSERT INTO time_management (guild_id, user_id, timex) VALUES ($1, $2, $3) "
+        "ON CONFLICT (guild_id, user_id) DO UPDATE SET timex = time_management.timex + EXCLUDED.timex "
+        "RETURNING timex"
+    ),
+    # returns nothing when today's goal was already completed
+    "daily_goal.complete": (
+        "INSERT INTO time_management (guild_id, user_id, timex, daily_goal_complete) VALUES ($1, $2, $3, TRUE) "
+        "ON CONFLICT (guild_id, user_id) DO UPDATE SET timex = time_management.timex + EXCLUDED.timex, daily_goal_complete = TRUE "
+        "WHERE NOT time_management.daily_goal_complete "
+        "RETURNING timex"
+    ),
+    "timers.start": "INSERT INTO timers (guild_id, user_id, task_name, start_time) VALUES ($1, $2, $3, $4) RETURNING id",
+    "timers.finish": "UPDATE timers SET duration = $1, completed = TRUE WHERE id = $2",
+    # newest running timer per user and guild, served by the partial index on running timers
+    "timers.active": (
+        "SELECT DISTINCT ON (guild_id, user_id) id, guild_id, user_id, task_name, start_time FROM timers "
+        "WHERE NOT completed ORDER BY guild_id, user_id, start_time DESC"
+    ),
+    # a user has at most one running timer, older unfinished rows were left behind and are closed with no time
+    "timers.close_stale": (
+        "UPDATE timers SET completed = TRUE, duration = 0 WHERE NOT completed AND id NOT IN ("
+        "SELECT DISTINCT ON (guild_id, user_id) id FROM timers "
+        "WHERE NOT completed ORDER BY guild_id, user_id, start_time DESC)"
+    ),
+    "timers.completed_since": (
+        "SELECT task_name, duration FROM timers "
+        "WHERE guild_id = $1 AND user_id = $2 AND completed = TRUE AND start_time > (NOW() AT TIME ZONE 'UTC') - $3::interval"
+    ),
+    "schedules.insert": (
+        "INSERT INTO schedules (guild_id, user_id, schedule_date, task_name, task_time, is_weekly) VALUES ($1, $2, $3, $4, $5, $6)"
+    ),
+    "schedules.for_day": (
+        "SELECT task_name, task_time, is_weekly FROM schedules "
+        "WHERE guild_id = $1 AND user_id = $2 AND (schedule_date = $3 OR is_weekly = TRUE)"
+    ),
+    "schedules.delete": "DELETE FROM schedules WHERE guild_id = $1 AND user_id = $2 AND task_name = $3 AND task_time = $4",
+
+    # fitness
+    "leveling.set_level": "UPDATE leveling SET strength = $1, powerlevel = $2 WHERE guild_id = $3 AND user_id = $4",
+    "leveling.add_stats": (
+        "INSERT INTO leveling (guild_id, user_id, pushup, pullup, run, situp, strength, powerlevel) VALUES ($1, $2, $3, $4, $5, $6, $7, 1) "
+        "ON CONFLICT (guild_id, user_id) DO UPDATE SET pushup = leveling.pushup + EXCLUDED.pushup, pullup = leveling.pullup + EXCLUDED.pullup, "
+        "run = leveling.run + EXCLUDED.run, situp = leveling.situp + EXCLUDED.situp, strength = leveling.strength + EXCLUDED.strength "
+        "RETURNING powerlevel, strength, pushup, pullup, run, situp"
+    ),
+
+    # one row per user even without any data, the profile cache loads it in a single round trip
+    "profiles.get": (
+        "SELECT l.powerlevel, l.strength, l.pushup, l.pullup, l.run, l.situp, t.timex, g.active_goals, g.completed_goals "
+        "FROM (SELECT $1::BIGINT AS guild_id, $2::BIGINT AS user_id) u "
+        "LEFT JOIN leveling l ON l.guild_id = u.guild_id AND l.user_id = u.user_id "
+        "LEFT JOIN time_management t ON t.guild_id = u.guild_id AND t.user_id = u.user_id "
+        "CROSS JOIN LATERAL ("
+        "SELECT COUNT(*) FILTER (WHERE NOT completed) AS active_goals, COUNT(*) FILTER (WHERE completed) AS completed_goals "
+        "FROM goals WHERE goals.guild_id = u.guild_id AND goals.user_id = u.user_id"
+        ") g"
+    ),
+
+    # goals
+    "goals.insert": (
+        "INSERT INTO goals (guild_id, user_id, name, deadline, priority, progress, completed) VALUES ($1, $2, $3, $4, $5, $6, $7)"
+    ),
+    "goals.active": (
+        "SELECT name, deadline, priority, progress FROM goals "
+        "WHERE guild_id = $1 AND user_id = $2 AND completed = FALSE ORDER BY priority, deadline"
+    ),
+    "goals.completed": (
+        "SELECT name, deadline, priority, progress FROM goals "
+        "WHERE guild_id = $1 AND user_id = $2 AND completed = TRUE ORDER BY deadline"
+    ),
+    # a goal is marked as completed in the same statement once its progress reaches 100
+    "goals.set_progress": (
+        "UPDATE goals SET progress = $1, completed = completed OR $1 = 100 WHERE guild_id = $2 AND user_id = $3 AND name = $4"
+    ),
+    "goals.set_deadline": "UPDATE goals SET deadline = $1 WHERE guild_id = $2 AND user_id = $3 AND name = $4",
+    "goals.set_priority": "UPDATE goals SET priority = $1 WHERE guild_id = $2 AND user_id = $3 AND name = $4",
+    "goals.delete": "DELETE FROM goals WHERE guild_id = $1 AND user_id = $2 AND name = $3",
+
+    # guild settings
+    "guild_settings.all": "SELECT guild_id, announce_channel_id, prefix, disabled_features FROM guild_settings",
+    "guild_settings.save": (
+        "INSERT INTO guild_settings (guild_id, announce_channel_id, prefix, disabled_features) VALUES ($1, $2, $3, $4) "
+        "ON CONFLICT (guild_id) DO UPDATE SET announce_channel_id = EXCLUDED.announce_channel_id, "
+        "prefix = EXCLUDED.prefix, disabled_features = EXCLUDED.disabled_features"
+    ),
+}
+
+
+class StatementStats:
+    __slots__ = ("calls", "total_time", "max_time")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+# The round trips of the command that is currently running.
+class CommandTrace:
+    __slots__ = ("label", "statements")
+
+    def __init__(self, label):
+        self.label = label
+        self.statements = []
+
+
+class QueryCatalogue:
+    def __init__(self, statements, max_round_trips=0):
+        self.statements = statements
+        self.stats = {name: StatementStats() for name in statements}
+        self.max_round_trips = max_round_trips  # debug mode is on when this is above zero
+        self._trace = contextvars.ContextVar("command_trace", default=None)
+
+    async def _run(self, method, conn, name, args):
+        query = self.statements[name]
+        started = time.perf_counter()
+        try:
+            return await getattr(conn, method)(query, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.stats[name]
+            stats.calls += 1
+            stats.total_time += elapsed
+            if elapsed > stats.max_time:
+                stats.max_time = elapsed
+            trace = self._trace.get()
+            if trace is not None:
+                trace.statements.append(name)
+
+    async def execute(self, conn, name, *args):
+        return await self._run("execute", conn, name, args)
+
+    async def fetch(self, conn, name, *args):
+        return await self._run("fetch", conn, name, args)
+
+    async def fetchrow(self, conn, name, *args):
+        return await self._run("fetchrow", conn, name, args)
+
+    async def fetchval(self, conn, name, *args):
+        return await self._run("fetchval", conn, name, args)
+
+    # records a round trip that does not go through a named statement, like a transaction's BEGIN and COMMIT
+    def note(self, label):
+        trace = self._trace.get()
+        if trace is not None:
+            trace.statements.append(label)
+
+    # start_trace/end_trace bracket one command, they are called from the bot's invoke hooks
+    def start_trace(self, label):
+        self._trace.set(CommandTrace(label))
+
+    def end_trace(self):
+        trace = self._trace.get()
+        self._trace.set(None)
+        if trace is None:
+            return None
+        if self.max_round_trips and len(trace.statements) > self.max_round_trips:
+            print(f"[db debug] {trace.label} made {len(trace.statements)} round trips "
+                  f"(limit {self.max_round_trips}): {', '.join(trace.statements)}")
+        return trace
+
+    @contextmanager
+    def trace(self, label):
+        """traces everything run inside the block as one command, for entry points that are not commands"""
+        self.start_trace(label)
+        try:
+            yield
+        finally:
+            self.end_trace()
+
+    def report(self):
+        """returns (name, calls, total seconds, average seconds, slowest seconds) for every statement that ran"""
+        rows = []
+        for name, stats in self.stats.items():
+            if stats.calls:
+                rows.append((name, stats.calls, stats.total_time, stats.total_time / stats.calls, stats.max_time))
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+
+catalogue = QueryCatalogue(STATEMENTS, max_round_trips=int(os.getenv("DB_MAX_ROUND_TRIPS", "0")))
+
+execute = catalogue.execute
+fetch = catalogue.fetch
+fetchrow = catalogue.fetchrow
+fetchval = catalogue.fetchval
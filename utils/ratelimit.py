@@ -0,0 +1,167 @@
+import os
+import time
+
+from discord.ext import commands
+from dotenv import load_dotenv
+
+from utils.lru import LRUCache
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # only needed when RATE_LIMIT_REDIS_URL is set
+    aioredis = None
+
+load_dotenv()
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, try again in {retry_after:.1f}s.")
+        self.retry_after = retry_after
+
+
+# "5/10" means 5 commands per 10 seconds, kept as a refill rate (tokens per second) and a burst capacity.
+class BucketSpec:
+    __slots__ = ("rate", "capacity")
+
+    def __init__(self, text):
+        count, seconds = text.split("/")
+        self.capacity = float(count)
+        self.rate = self.capacity / float(seconds)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+# In-memory token buckets per user, per guild and per user and command. Commands listed in command_overrides
+# (e.g. the reddit ones, which share one API quota) also have a bucket for the whole bot. A command goes through
+# only when every bucket it touches has a token, and only then are the tokens taken. Idle buckets fall out of
+# the LRU, which is fine because a bucket that has been idle long enough is full again anyway.
+class RateLimiter:
+    def __init__(self, user, guild, command, command_overrides=None, maxsize=50_000):
+        self.user = user
+        self.guild = guild
+        self.command = command
+        self.command_overrides = command_overrides or {}
+        self._buckets = LRUCache(maxsize)
+        self._warned = LRUCache(maxsize)  # user id -> until when they have already been told to slow down
+
+    async def close(self):
+        pass  # local buckets hold nothing that needs closing
+
+    def _keys(self, user_id, guild_id, command_name):
+        keys = [(("user", user_id), self.user), (("user_command", f"{user_id}:{command_name}"), self.command)]
+        if guild_id is not None:
+            keys.append((("guild", guild_id), self.guild))
+        if command_name in self.command_overrides:
+            keys.append((("command", command_name), self.command_overrides[command_name]))
+        return keys
+
+    def should_warn(self, user_id, retry_after):
+        """True for the first rejection of a user until their buckets refill, so spam gets one reply, not one each"""
+        now = time.monotonic()
+        until = self._warned.get(user_id)
+        if until is not None and now < until:
+            return False
+        self._warned[user_id] = now + retry_after
+        return True
+
+    async def hit(self, user_id, guild_id, command_name):
+        """takes a token from every bucket of this command, returns 0 or the seconds to wait"""
+        now = time.monotonic()
+        refilled = []
+        retry_after = 0.0
+        for key, spec in self._keys(user_id, guild_id, command_name):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(spec.capacity, now)
+                self._buckets[key] = bucket
+            bucket.tokens = min(spec.capacity, bucket.tokens + (now - bucket.updated) * spec.rate)
+            bucket.updated = now
+            if bucket.tokens < 1:
+                retry_after = max(retry_after, (1 - bucket.tokens) / spec.rate)
+            refilled.append(bucket)
+
+        if retry_after:
+            return retry_after
+        for bucket in refilled:
+            bucket.tokens -= 1
+        return 0.0
+
+
+# Same buckets kept in a Redis-compatible server, so several bot processes share one limit.
+# All buckets of a command are checked and taken in one script, so the check stays atomic.
+REDIS_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local available = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(capacity, available + math.max(0, now - updated) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local capacity = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'updated', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return '0'
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    def __init__(self, url, user, guild, command, command_overrides=None):
+        super().__init__(user, guild, command, command_overrides)
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(REDIS_SCRIPT)
+
+    async def hit(self, user_id, guild_id, command_name):
+        keys, args = [], [time.time()]
+        for (scope, value), spec in self._keys(user_id, guild_id, command_name):
+            keys.append(f"zenith:ratelimit:{scope}:{value}")
+            args.extend((spec.rate, spec.capacity))
+        try:
+            return float(await self._script(keys=keys, args=args))
+        except aioredis.RedisError as error:
+            # the shared server being down shouldn't take the bot with it, fall back to this process' buckets
+            print(f"Rate limit server unavailable, using local buckets: {error}")
+            return await super().hit(user_id, guild_id, command_name)
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_rate_limiter():
+    user = BucketSpec(os.getenv("RATE_LIMIT_USER", "5/10"))
+    guild = BucketSpec(os.getenv("RATE_LIMIT_GUILD", "60/10"))
+    command = BucketSpec(os.getenv("RATE_LIMIT_COMMAND", "3/10"))
+    overrides = {}
+    for entry in filter(None, os.getenv("RATE_LIMIT_COMMANDS", "").split(",")):
+        name, spec = entry.split("=")
+        overrides[name.strip()] = BucketSpec(spec.strip())
+
+    redis_url = os.getenv("RATE_LIMIT_REDIS_URL")
+    if redis_url:
+        if aioredis is not None:
+            return RedisRateLimiter(redis_url, user, guild, command, overrides)
+        print("RATE_LIMIT_REDIS_URL is set but the redis package is not installed, using local buckets.")
+    return RateLimiter(user, guild, command, overrides)
+
+
+limiter = create_rate_limiter()